@@ -1,41 +1,61 @@
+from __future__ import annotations
+
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from PIL import Image, ImageTk, ImageSequence
 import threading
-import yt_dlp
+import logging
 import os
-import time
-import pygame
 import sys
-import json
 import shutil
 import subprocess
 import platform
 import webbrowser
-import urllib.request
-import zipfile
 from tkinter import simpledialog
-import tempfile
-import urllib.parse
-import re
-
-try:
-    import py7zr
-except ImportError:
-    import subprocess
-    import sys
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "py7zr"])
-    import py7zr
+import hashlib
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import TYPE_CHECKING
+
+from zking_core import (
+    FFMPEG_FOLDER,
+    MAX_WORKERS_DEFAULT,
+    SETTINGS_FILE,
+    BandwidthManager,
+    DownloadEngine,
+    DownloadHistory,
+    DownloadJob,
+    DownloadPipeline,
+    FFmpegBootstrap,
+    MetadataCache,
+    best_encoder,
+    encoder_speed,
+    extraer_video_id,
+    limpiar_url_video,
+    load_settings,
+    probe_encoders,
+    save_settings,
+    select_video_format,
+    video_only_formats,
+)
+
+if TYPE_CHECKING:  # solo para las anotaciones: en ejecución se importan al usarse
+    import pygame
+    from PIL import ImageTk
+
+log = logging.getLogger("zking")
 
 FFMPEG_URL = "https://www.gyan.dev/ffmpeg/builds/ffmpeg-git-full.7z"
-FFMPEG_FOLDER = "ffmpeg_bin"
 
 FONDO_COLOR = "#0b1113"
 BOTON_COLOR = "#1f6feb"
 TEXTO_COLOR = "#ffffff"
 FUENTE = ("Arial", 11)
-CONFIG_FILE = "config.txt"
+CONFIG_FILE = "config.txt"  # formato antiguo; se migra a config.json
 HISTORIAL_FILE = "historial.json"
+THUMBS_FOLDER = "thumbs_cache"
+THUMB_SIZE = (160, 90)
 DEFAULT_FOLDER = os.path.join(os.getcwd(), "downloads")
 os.makedirs(DEFAULT_FOLDER, exist_ok=True)
 
@@ -46,6 +66,9 @@ PREFERIDOS = [
     ("libx264", "CPU (universal, más lento)"),
 ]
 
+# yt_dlp, PIL y pygame tardan en importarse: se cargan la primera vez que se usan
+# para que la ventana aparezca cuanto antes.
+
 # ===================== helpers ===================== #
 
 def resource_path(relative_path: str) -> str:
@@ -61,7 +84,7 @@ def ffmpeg_available() -> bool:
     if shutil.which("ffmpeg"):
         return True
     # Busca en ffmpeg_bin local
-    local_ffmpeg = os.path.join(os.getcwd(), "ffmpeg_bin", "ffmpeg.exe")
+    local_ffmpeg = os.path.join(os.getcwd(), FFMPEG_FOLDER, "ffmpeg.exe")
     return os.path.isfile(local_ffmpeg)
 
 
@@ -73,19 +96,29 @@ def add_to_path(path: str) -> None:
 # ===================== descarga automática de FFmpeg ===================== #
 
 class FFmpegInstaller:
-    """Maneja la descarga e instalación automática de FFmpeg (solo Windows)."""
-
-    WINDOWS_ZIP_URL = (
-        "https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip"
-    )
+    """
+    Instala FFmpeg en segundo plano (solo Windows) con FFmpegBootstrap y publica
+    el avance en la ventana principal sin bloquearla.
+    """
 
     def __init__(self, parent: tk.Tk):
         self.parent = parent
-        self.install_dir = os.path.join(os.getcwd(), "ffmpeg_bin")
-        os.makedirs(self.install_dir, exist_ok=True)
+        self.install_dir = os.path.join(os.getcwd(), FFMPEG_FOLDER)
+        self.bootstrap = FFmpegBootstrap(self.install_dir, on_progress=self._update_progress)
+
+    def start(self, on_done=None) -> bool:
+        """
+        Lanza la instalación en un hilo; on_done(ok) se llama luego en el hilo de Tk.
+        Devuelve False (sin hacer nada) si no hay instalación automática para este sistema.
+        """
+        if platform.system() != "Windows":
+            return False
+        threading.Thread(target=self._install, args=(on_done,), name="ffmpeg-install",
+                         daemon=True).start()
+        return True
 
     def prompt_install(self) -> bool:
-        """Pregunta al usuario y, en caso afirmativo, intenta instalar FFmpeg."""
+        """Pregunta al usuario y, en caso afirmativo, empieza a instalar FFmpeg."""
         if platform.system() != "Windows":
             messagebox.showinfo(
                 "Instalación no soportada",
@@ -99,66 +132,183 @@ class FFmpegInstaller:
             "No se encontró FFmpeg en tu sistema.\n\n"
             "¿Deseas que la aplicación lo descargue e instale automáticamente?",
         )
-        if not resp:
-            return False
+        return resp and self.start(lambda ok: ok and messagebox.showinfo(
+            "FFmpeg instalado", "FFmpeg se instaló correctamente y está listo para usarse."))
 
+    def _install(self, on_done) -> None:
+        error = None
         try:
-            self._download_and_extract()
+            self.bootstrap.install()
             add_to_path(self.install_dir)
-            if ffmpeg_available():
-                messagebox.showinfo(
-                    "FFmpeg instalado",
-                    "FFmpeg se instaló correctamente y está listo para usarse.",
-                )
-                return True
-            else:
-                raise RuntimeError("FFmpeg sigue sin detectarse tras la instalación.")
+            if not ffmpeg_available():
+                error = "FFmpeg sigue sin detectarse tras la instalación."
         except Exception as err:
+            error = str(err)
+        self.parent.ui.call(self._finished, error, on_done)
+
+    def _finished(self, error: str | None, on_done) -> None:
+        if error is None:
+            self.parent.set_progress(0, "FFmpeg listo.")
+        else:
+            self.parent.set_progress(0, "No se pudo instalar FFmpeg.")
             messagebox.showerror(
                 "Error de instalación",
-                f"Ocurrió un problema instalando FFmpeg automáticamente:\n{err}\n\n"
+                f"Ocurrió un problema instalando FFmpeg automáticamente:\n{error}\n\n"
                 "Procede a instalarlo manualmente si el problema persiste.",
             )
-            return False
-
-    def _download_and_extract(self) -> None:
-        """Descarga el ZIP oficial de FFmpeg y extrae ffmpeg.exe."""
-        tmp_fd, tmp_path = tempfile.mkstemp(suffix=".zip")
-        os.close(tmp_fd)
-
-        # Descarga
-        with urllib.request.urlopen(self.WINDOWS_ZIP_URL) as resp, open(tmp_path, "wb") as out_f:
-            total = int(resp.headers.get("Content-Length", 0))
-            read = 0
-            chunk = 8192
-            while True:
-                buf = resp.read(chunk)
-                if not buf:
-                    break
-                out_f.write(buf)
-                read += len(buf)
-                self._update_progress(read, total)
-
-        # Extracción
-        with zipfile.ZipFile(tmp_path) as z:
-            members = [m for m in z.namelist() if m.endswith("ffmpeg.exe")]
-            if not members:
-                raise FileNotFoundError("ffmpeg.exe no encontrado en el ZIP.")
-            for m in members:
-                extracted_path = z.extract(m, self.install_dir)
-                # mover ffmpeg.exe a la raíz de install_dir
-                target_path = os.path.join(self.install_dir, "ffmpeg.exe")
-                shutil.move(extracted_path, target_path)
-                break  # solo necesitamos uno
-        os.remove(tmp_path)
+        if on_done:
+            on_done(error is None)
 
     def _update_progress(self, read: int, total: int) -> None:
-        """Actualiza una barra de progreso simple en la ventana principal."""
+        """Publica el avance en el bus de la ventana principal (a ritmo limitado)."""
         percent = read / total * 100 if total else 0
-        self.parent.progress["value"] = percent
-        self.parent.status_label.config(
-            text=f"Descargando FFmpeg... {percent:0.1f}%")
-        self.parent.update_idletasks()
+        self.parent.ui.post("progreso", self.parent.set_progress, percent,
+                            f"Descargando FFmpeg... {percent:0.1f}%")
+
+# ===================== bus de eventos de interfaz ===================== #
+
+class UIEventBus:
+    """
+    Cola de actualizaciones de la interfaz, segura entre hilos.
+
+    Los workers publican aquí en vez de tocar los widgets: `post` agrupa las
+    actualizaciones por clave (solo se aplica la última) y `call` encola acciones
+    que deben ejecutarse todas y en orden. Un único bucle after() en el hilo de Tk
+    las aplica a un ritmo fijo de `fps` cuadros por segundo.
+    """
+
+    def __init__(self, root: tk.Tk, fps: int = 15) -> None:
+        self.root = root
+        self.interval = max(1, int(1000 / fps))
+        self._calls: queue.SimpleQueue = queue.SimpleQueue()
+        self._latest: dict = {}
+        self._lock = threading.Lock()
+        self.root.after(self.interval, self._pump)
+
+    def post(self, key, func, *args) -> None:
+        """Actualización agrupable: si llegan varias con la misma clave, gana la última."""
+        with self._lock:
+            self._latest[key] = (func, args)
+
+    def call(self, func, *args) -> None:
+        """Acción que no se puede descartar (diálogos, sonidos, cambios de estado)."""
+        self._calls.put((func, args))
+
+    def flush(self) -> None:
+        """Aplica lo pendiente. Solo desde el hilo de Tk."""
+        while True:
+            try:
+                func, args = self._calls.get_nowait()
+            except queue.Empty:
+                break
+            self._run(func, args)
+        with self._lock:
+            latest, self._latest = self._latest, {}
+        for func, args in latest.values():
+            self._run(func, args)
+
+    @staticmethod
+    def _run(func, args) -> None:
+        try:
+            func(*args)
+        except tk.TclError:
+            pass  # un widget destruido no debe parar el bucle de eventos
+        except Exception:
+            # Un fallo real de la interfaz: se registra sin parar el bucle de eventos
+            log.exception("Error en una actualización de la interfaz (%s)", getattr(func, "__name__", func))
+
+    def _pump(self) -> None:
+        self.flush()
+        self.root.after(self.interval, self._pump)
+
+# ===================== miniaturas ===================== #
+
+class ThumbnailLoader:
+    """
+    Carga miniaturas fuera del camino crítico de la descarga.
+
+    Un pool pequeño baja y redimensiona la imagen a 160x90, que se guarda en una
+    caché en disco con tamaño máximo; las PhotoImage ya decodificadas se reutilizan
+    desde una LRU en memoria. El resultado se entrega en el hilo de Tk vía UIEventBus.
+    """
+
+    def __init__(self, parent: tk.Tk, folder: str = THUMBS_FOLDER, workers: int = 2,
+                 max_disk_bytes: int = 20 * 1024 * 1024, max_memory: int = 64) -> None:
+        self.parent = parent
+        self.folder = folder
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory = max_memory
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="miniatura")
+        self._memory: OrderedDict[str, ImageTk.PhotoImage] = OrderedDict()  # solo hilo de Tk
+        self._disk_lock = threading.Lock()
+        os.makedirs(self.folder, exist_ok=True)
+
+    def _disk_path(self, url: str) -> str:
+        return os.path.join(self.folder, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".png")
+
+    def request(self, url: str, callback) -> None:
+        """Pide la miniatura; callback(photo o None) se ejecuta luego en el hilo de Tk."""
+        self._pool.submit(self._load, url, callback)
+
+    def _load(self, url: str, callback) -> None:
+        path = self._disk_path(url)
+        try:
+            if os.path.exists(path):
+                os.utime(path)  # marca de uso para la expulsión por antigüedad
+                data = None
+            else:
+                from urllib.request import urlopen
+                from PIL import Image
+
+                raw = urlopen(url, timeout=10).read()
+                img = Image.open(BytesIO(raw)).convert("RGB").resize(THUMB_SIZE)
+                buf = BytesIO()
+                img.save(buf, format="PNG")
+                data = buf.getvalue()
+                with self._disk_lock:
+                    with open(path, "wb") as f:
+                        f.write(data)
+                    self._trim_disk()
+        except Exception:
+            self.parent.ui.call(callback, None)
+            return
+        self.parent.ui.call(self._deliver, url, path, data, callback)
+
+    def _deliver(self, url: str, path: str, data: bytes | None, callback) -> None:
+        photo = self._memory.get(url)
+        if photo is None:
+            from PIL import Image, ImageTk
+
+            try:
+                photo = ImageTk.PhotoImage(Image.open(BytesIO(data) if data else path))
+            except Exception:
+                callback(None)
+                return
+            self._memory[url] = photo
+            while len(self._memory) > self.max_memory:
+                self._memory.popitem(last=False)
+        self._memory.move_to_end(url)
+        callback(photo)
+
+    def _trim_disk(self) -> None:
+        """Borra las miniaturas usadas hace más tiempo si la caché supera el límite."""
+        files = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _mtime, size, _path in files)
+        for _mtime, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
 
 # ===================== clase principal ===================== #
 
@@ -174,29 +324,41 @@ class YouTubeDownloader(tk.Tk):
             self.iconbitmap(resource_path("img/logo.ico"))
         except Exception:
             pass
-        self.geometry("600x650")
+        self.geometry("600x760")
         self.resizable(False, False)
         self.configure(bg=FONDO_COLOR)
 
-        # ---- audio de interfaz ---- #
-        pygame.mixer.init()
-        self.sfx: dict[str, pygame.mixer.Sound] = {}
+        # ---- audio de interfaz (pygame.mixer se inicia en el primer play_sound) ---- #
+        self.sfx: dict[str, "pygame.mixer.Sound"] = {}
+        self._mixer_ready: bool | None = None  # None: sin intentar, False: no disponible
 
         # ---- variables de estado ---- #
         self.url_var = tk.StringVar()
         self.formats: list[tuple[str, str]] = []  # (descripcion, itag)
+        self.formats_url: str = ""  # URL a la que pertenecen self.formats
+        self.formats_info: dict | None = None  # info de yt-dlp de esa URL, se reutiliza al descargar
         self.selected_format = tk.StringVar()
         self.download_folder = DEFAULT_FOLDER
-        self._start_time = None
+        self.staging_folder: str | None = None  # None: <destino>/temp o ZKING_STAGING_DIR
         self.current_video_title: str = ""
         self.current_thumbnail: ImageTk.PhotoImage | None = None
+        self.ui = UIEventBus(self)
+        self.thumbnails = ThumbnailLoader(self)
+        self._thumbnail_url: str | None = None  # la última pedida es la que se muestra
         self.only_mp3 = tk.BooleanVar(value=False)
+        self.prefer_h264 = tk.BooleanVar(value=True)
         self.encoder = None
+        self.encoder_preset: str | None = None
         self.modo_var = tk.StringVar(value="video")  # video, lista, multi
+        self.max_workers = tk.IntVar(value=MAX_WORKERS_DEFAULT)
+        self.transcode_workers = tk.IntVar(value=DownloadPipeline.DEFAULT_WORKERS["transcode"])
+        self.rate_limit_mb = tk.IntVar(value=0)  # MB/s para todo el lote; 0 = sin límite
+        self.pipeline: DownloadPipeline | None = None
+        self.metadata_cache = MetadataCache()
+        self.history = DownloadHistory(legacy_json=HISTORIAL_FILE)
 
         # ---- carga configuración previa ---- #
         self.load_config()
-        # self.ask_encoder_if_needed()  # <-- QUITAR selección de encoder al inicio
 
         # ---- gestionar FFmpeg ---- #
         self.after(100, self.ensure_ffmpeg_and_encoder)
@@ -207,67 +369,15 @@ class YouTubeDownloader(tk.Tk):
         self.bind_shortcuts()
 
     def ensure_ffmpeg_and_encoder(self):
-        # 1. Asegura FFmpeg antes de cualquier otra cosa
-        self.ensure_ffmpeg()
-        # 2. Carga encoder (o usa por defecto si no existe)
-        self.load_encoder()
-
-    def ensure_ffmpeg(self):
-        exe_path = os.path.join(os.getcwd(), "ffmpeg_bin", "ffmpeg.exe")
-        if not os.path.exists(exe_path):
-            try:
-                # Usa el ZIP oficial (no el 7z)
-                tmp_zip = os.path.join(os.getcwd(), "ffmpeg_bin", "ffmpeg_tmp.zip")
-                os.makedirs("ffmpeg_bin", exist_ok=True)
-                url = "https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip"
-                with urllib.request.urlopen(url) as resp, open(tmp_zip, "wb") as out_f:
-                    shutil.copyfileobj(resp, out_f)
-                with zipfile.ZipFile(tmp_zip) as z:
-                    exe_files = [f for f in z.namelist() if f.endswith("ffmpeg.exe")]
-                    if not exe_files:
-                        raise RuntimeError("ffmpeg.exe no encontrado en el ZIP")
-                    for f in exe_files:
-                        extracted_path = z.extract(f, "ffmpeg_bin")
-                        dst = os.path.join("ffmpeg_bin", "ffmpeg.exe")
-                        shutil.move(extracted_path, dst)
-                        subdir = os.path.dirname(extracted_path)
-                        if os.path.exists(subdir) and subdir != "ffmpeg_bin":
-                            shutil.rmtree(subdir, ignore_errors=True)
-                        break
-                os.remove(tmp_zip)
-            except Exception as e:
-                messagebox.showerror("Error", f"No se pudo descargar FFmpeg:\n{e}")
+        # 1. Asegura FFmpeg (en segundo plano si hay que bajarlo)
+        # 2. Carga encoder (o usa por defecto si no existe) cuando FFmpeg esté listo
+        self.ensure_ffmpeg(self.load_encoder)
 
-    def load_encoder(self):
-        if os.path.exists("config.txt"):
-            with open("config.txt", "r", encoding="utf-8") as f:
-                self.encoder = f.read().strip()
-        else:
-            self.encoder = "libx264"  # Usa por defecto, no pregunta
-
-    def select_encoder_dialog(self):
-        opciones = [
-            ("h264_nvenc", "Tengo NVIDIA (rápido, recomendado para edición)"),
-            ("h264_amf", "Tengo AMD (rápido, recomendado para edición)"),
-            ("h264_qsv", "Tengo solo gráficos integrados Intel"),
-            ("libx264", "Solo CPU (universal, más lento)"),
-        ]
-        msg = "¿Qué tipo de gráfica tienes?\n\n"
-        for i, (cod, desc) in enumerate(opciones, 1):
-            msg += f"{i}. {desc}\n"
-        msg += "\nEscribe el número de la opción:"
-        sel = simpledialog.askinteger("Configuración de encoder", msg, minvalue=1, maxvalue=len(opciones))
-        if sel and 1 <= sel <= len(opciones):
-            self.encoder = opciones[sel-1][0]
-            with open("config.txt", "w", encoding="utf-8") as f:
-                f.write(self.encoder)
-            messagebox.showinfo("Encoder guardado", f"Encoder '{self.encoder}' guardado en config.txt")
-        else:
-            # Si cancela, usa libx264 por defecto
-            self.encoder = "libx264"
-            with open("config.txt", "w", encoding="utf-8") as f:
-                f.write(self.encoder)
-            messagebox.showwarning("Sin cambios", "No se cambió el encoder. Se usará CPU (libx264).")
+    def ensure_ffmpeg(self, on_ready=None) -> None:
+        """Si falta FFmpeg lo instala sin bloquear la ventana; luego llama a on_ready()."""
+        listo = on_ready or (lambda: None)
+        if ffmpeg_available() or not FFmpegInstaller(self).start(lambda _ok: listo()):
+            listo()
 
     # ---------- comprobación e instalación de FFmpeg ---------- #
 
@@ -290,15 +400,20 @@ class YouTubeDownloader(tk.Tk):
     # ---------- configuración ---------- #
 
     def load_config(self) -> None:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                path = f.read().strip()
-                if os.path.isdir(path):
-                    self.download_folder = path
+        self.settings = load_settings(legacy_txt=CONFIG_FILE)
+        if os.path.isdir(self.settings.get("download_folder", "")):
+            self.download_folder = self.settings["download_folder"]
+        if os.path.isdir(self.settings.get("staging_folder") or ""):
+            self.staging_folder = self.settings["staging_folder"]
 
     def save_config(self) -> None:
-        with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-            f.write(self.download_folder)
+        self.settings.update(
+            download_folder=self.download_folder,
+            staging_folder=self.staging_folder,
+            encoder=self.encoder,
+            encoder_preset=self.encoder_preset,
+        )
+        save_settings(self.settings)
 
     # ---------- atajos ---------- #
 
@@ -308,33 +423,6 @@ class YouTubeDownloader(tk.Tk):
         self.bind("<Control-d>", lambda _e: self.download_thread())
         self.bind("<Control-h>", lambda _e: self.show_history())
 
-    # ---------- menú ---------- #
-
-    def create_menu(self) -> None:
-        menubar = tk.Menu(self)
-        self.config(menu=menubar)
-
-        archivo_menu = tk.Menu(menubar, tearoff=0)
-        archivo_menu.add_command(label="Seleccionar carpeta...", command=self.select_folder)
-        archivo_menu.add_command(label="Ver historial", command=self.show_history)
-        archivo_menu.add_separator()
-        archivo_menu.add_command(label="Salir", command=self.destroy)
-        menubar.add_cascade(label="Archivo", menu=archivo_menu)
-
-        config_menu = tk.Menu(menubar, tearoff=0)
-        config_menu.add_command(label="Cambiar encoder de video...", command=self.select_encoder_dialog)
-        menubar.add_cascade(label="Configuración", menu=config_menu)
-
-        ayuda_menu = tk.Menu(menubar, tearoff=0)
-        ayuda_menu.add_command(label="Acerca de formatos", command=self.show_help)
-        ayuda_menu.add_command(
-            label="Créditos", command=lambda: messagebox.showinfo(
-                "Créditos",
-                "Desarrollado por zkingStudios\nContacto: zking500studio@gmail.com"
-            )
-        )
-        menubar.add_cascade(label="Ayuda", menu=ayuda_menu)
-
     # ---------- widgets ---------- #
 
     def create_widgets(self) -> None:
@@ -386,17 +474,51 @@ class YouTubeDownloader(tk.Tk):
         )
         self.only_mp3_check.pack(pady=2)
 
+        self.prefer_h264_check = ttk.Checkbutton(
+            self, text="Preferir H.264 (sin recodificar, más rápido)", variable=self.prefer_h264
+        )
+        self.prefer_h264_check.pack(pady=2)
+
+        # Descargas simultáneas (modo multi) y estado de cada trabajo
+        workers_frame = tk.Frame(self, bg=FONDO_COLOR)
+        workers_frame.pack(pady=2)
+        tk.Label(workers_frame, text="Descargas simultáneas:", bg=FONDO_COLOR, fg=TEXTO_COLOR,
+                 font=FUENTE).pack(side="left")
+        tk.Spinbox(workers_frame, from_=1, to=8, width=3, textvariable=self.max_workers,
+                   state="readonly").pack(side="left", padx=5)
+        tk.Label(workers_frame, text="Conversiones:", bg=FONDO_COLOR, fg=TEXTO_COLOR,
+                 font=FUENTE).pack(side="left")
+        tk.Spinbox(workers_frame, from_=1, to=8, width=3, textvariable=self.transcode_workers,
+                   state="readonly").pack(side="left", padx=5)
+        tk.Label(workers_frame, text="Límite MB/s:", bg=FONDO_COLOR, fg=TEXTO_COLOR,
+                 font=FUENTE).pack(side="left")
+        tk.Spinbox(workers_frame, from_=0, to=1000, width=4, textvariable=self.rate_limit_mb
+                   ).pack(side="left", padx=5)
+
+        self.jobs_list = tk.Listbox(self, height=5, width=70, bg=FONDO_COLOR, fg=TEXTO_COLOR,
+                                    font=("Arial", 9), highlightthickness=0)
+        self.jobs_list.pack(pady=2)
+
         # Label para la miniatura
         self.thumbnail_label = tk.Label(self, image=None, bg=FONDO_COLOR)
         self.thumbnail_label.pack()
 
     def load_logo(self) -> None:
+        # El hueco se reserva ya; la imagen se carga cuando la ventana está visible
+        self.logo_img = tk.PhotoImage(width=120, height=120)
+        self.logo_label = tk.Label(self, image=self.logo_img, bg=FONDO_COLOR)
+        self.logo_label.pack(pady=5)
+        self.after_idle(self._load_logo_image)
+
+    def _load_logo_image(self) -> None:
         logo_path = resource_path("img/logo.png")
         try:
+            from PIL import Image, ImageTk
+
             img = Image.open(logo_path).resize((120, 120))
             photo = ImageTk.PhotoImage(img)
             self.logo_img = photo  # evitar que el GC la limpie
-            tk.Label(self, image=photo, bg=FONDO_COLOR).pack(pady=5)
+            self.logo_label.config(image=photo)
         except Exception:
             pass
 
@@ -420,10 +542,23 @@ class YouTubeDownloader(tk.Tk):
 
     # ---------- utilidades de sonido ---------- #
 
+    def _init_mixer(self) -> bool:
+        if self._mixer_ready is None:
+            try:
+                import pygame
+
+                pygame.mixer.init()
+                self._mixer_ready = True
+            except Exception:
+                self._mixer_ready = False  # sin audio: la aplicación sigue funcionando
+        return self._mixer_ready
+
     def play_sound(self, name: str) -> None:
         path = resource_path(os.path.join("sfx", f"{name}.mp3"))
-        if os.path.exists(path):
+        if os.path.exists(path) and self._init_mixer():
             if name not in self.sfx:
+                import pygame
+
                 try:
                     self.sfx[name] = pygame.mixer.Sound(path)
                 except Exception:
@@ -448,6 +583,14 @@ class YouTubeDownloader(tk.Tk):
             self.status_label.config(text=f"Carpeta seleccionada: {folder}")
             self.play_sound("click")
 
+    def select_staging_folder(self) -> None:
+        folder = filedialog.askdirectory(title="Carpeta para archivos temporales (p. ej. un disco RAM)")
+        if folder:
+            self.staging_folder = folder
+            self.save_config()
+            self.status_label.config(text=f"Temporales en: {folder}")
+            self.play_sound("click")
+
     # ---------- mensajes de ayuda ---------- #
 
     @staticmethod
@@ -456,7 +599,8 @@ class YouTubeDownloader(tk.Tk):
             "Descarga simplificada:\n\n"
             "1. Se mostrará SOLO la lista de formatos VIDEO‑ONLY disponibles.\n"
             "2. El video se descargará y convertirá automáticamente a MP4 (H.264)\n   compatible con la mayoría de editores (DaVinci Resolve, etc.).\n"
-            "3. El audio se descarga aparte en la mejor calidad disponible y\n   se convierte a MP3 de 320 kbps.\n"
+            "   Con 'Preferir H.264' se eligen formatos MP4/avc1 y se copian sin\n   recodificar (mucho más rápido).\n"
+            "3. El audio se descarga aparte en la mejor calidad disponible y se\n   codifica una sola vez: AAC dentro del MP4, o MP3 de 320 kbps en modo música.\n"
             "4. Recuerda tener instalado FFmpeg para las conversiones."
         )
         messagebox.showinfo("Ayuda de formatos", msg)
@@ -464,13 +608,10 @@ class YouTubeDownloader(tk.Tk):
     # ---------- historial ---------- #
 
     def show_history(self) -> None:
-        if os.path.exists(HISTORIAL_FILE):
-            with open(HISTORIAL_FILE, "r", encoding="utf-8") as f:
-                datos = json.load(f)
-        else:
-            datos = []
-        historial_text = "\n\n".join(f"{d['fecha']} - {d['titulo']} ({d['formato']})" for d in datos)
-        messagebox.showinfo("Historial de Descargas", historial_text or "No hay descargas registradas aún.")
+        if self.history.count() == 0:
+            messagebox.showinfo("Historial de Descargas", "No hay descargas registradas aún.")
+            return
+        HistoryWindow(self, self.history)
 
     # =============================================================
     #                LISTADO DE FORMATOS (SOLO VIDEO)
@@ -485,62 +626,91 @@ class YouTubeDownloader(tk.Tk):
         url = limpiar_url_video(urls[0])
         self.status_label.config(text="Obteniendo formatos de video...")
         self.play_sound("click")
-        threading.Thread(target=self.list_formats, args=(url,), daemon=True).start()
+        threading.Thread(target=self.list_formats, args=(url, self.prefer_h264.get()), daemon=True).start()
 
-    def list_formats(self, url: str) -> None:
+    def list_formats(self, url: str, prefer_h264: bool = False) -> None:
         try:
-            ydl_opts = {"quiet": True, "skip_download": True}
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-            self.current_video_title = info.get("title", "video")
-            thumbnail_url = info.get("thumbnail")
-            self.formats = []
-
-            # miniatura
-            if thumbnail_url:
-                from urllib.request import urlopen
-                from io import BytesIO
-
-                data = urlopen(thumbnail_url).read()
-                img = Image.open(BytesIO(data)).resize((160, 90))
-                photo = ImageTk.PhotoImage(img)
-                self.current_thumbnail = photo
-                if hasattr(self, "thumbnail_label"):
-                    self.thumbnail_label.config(image=photo)  # <-- CORRECTO
-                    self.thumbnail_label.image = photo        # <-- CORRECTO
-
-            # Solo una WebM por resolución
-            seen_resolutions = set()
-            for f in info.get("formats", []):
-                acodec, vcodec = f.get("acodec"), f.get("vcodec")
-                ext = f.get("ext")
-                resolution = f.get("resolution") or (
-                    f.get("height") and f"{f.get('height')}p") or "?p"
-                if acodec == "none" and vcodec != "none" and ext == "webm":
-                    if resolution in seen_resolutions:
-                        continue
-                    seen_resolutions.add(resolution)
-                    itag = f.get("format_id")
-                    filesize = f.get("filesize") or f.get("filesize_approx") or 0
-                    size_mb = round(filesize / (1024 * 1024), 2)
-                    desc = f"{resolution} — {ext.upper()} — {size_mb}MB (itag:{itag})"
-                    self.formats.append((desc, itag))
-
-            self.combo_formats["values"] = [f[0] for f in self.formats]
-            if self.formats:
-                self.combo_formats.current(0)
-                preview_name = f"{self.current_video_title}.mp4"
-                self.filename_preview.config(text=f"Archivo de video final: {preview_name}")
-                self.status_label.config(text=f"Se encontraron {len(self.formats)} resoluciones de video.")
+            video_id = extraer_video_id(url)
+            cached = self.metadata_cache.get(video_id)
+            if cached is not None:
+                # Visto hace poco: no hace falta preguntar a YouTube
+                info = {"title": cached["title"], "thumbnail": cached["thumbnail"],
+                        "duration": cached.get("duration"), "formats": cached["formats"]}
+                full_info = None  # la descarga extraerá la info completa una vez
             else:
-                self.combo_formats.set("")
-                self.filename_preview.config(text="")
-                self.status_label.config(text="No se encontraron formatos de video‑only.")
+                import yt_dlp
+
+                ydl_opts = {"quiet": True, "noprogress": True, "skip_download": True}
+                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    info = ydl.extract_info(url, download=False)
+                self.metadata_cache.put(video_id, info)
+                full_info = info
+
+            # Un formato por resolución (el de menor coste) y el recomendado entre todos
+            coste = {"encoder": self.encoder, "encoder_fps": self._encoder_fps()}
+            formats = video_only_formats(info, prefer_h264, **coste)
+            elegido, motivo = select_video_format(info, prefer_h264=prefer_h264, **coste)
+            recomendado = elegido["format_id"] if elegido else None
+            self.ui.call(self._show_formats, url, info, full_info, formats, cached is not None,
+                         recomendado, motivo)
 
         except Exception as err:
-            messagebox.showerror("Error", f"No se pudo obtener formatos:\n{err}")
-            self.play_sound("error")
-            self.status_label.config(text="")
+            self.ui.call(self._show_error, f"No se pudo obtener formatos:\n{err}", "")
+
+    def _show_formats(self, url: str, info: dict, full_info: dict | None,
+                      formats: list[tuple[str, str]], from_cache: bool,
+                      recomendado: str | None = None, motivo: str = "") -> None:
+        self.current_video_title = info.get("title", "video")
+        thumbnail_url = info.get("thumbnail")
+
+        # miniatura
+        if thumbnail_url:
+            self.show_thumbnail(thumbnail_url)
+
+        self.formats = formats
+        self.formats_url = url
+        self.formats_info = full_info
+
+        self.combo_formats["values"] = [f[0] for f in self.formats]
+        if self.formats:
+            itags = [itag for _desc, itag in self.formats]
+            self.combo_formats.current(itags.index(recomendado) if recomendado in itags else 0)
+            preview_name = f"{self.current_video_title}.mp4"
+            self.filename_preview.config(text=f"Archivo de video final: {preview_name}")
+            origen = " (desde caché)" if from_cache else ""
+            self.status_label.config(text=f"Se encontraron {len(self.formats)} resoluciones de video{origen}. "
+                                          f"Recomendado: {motivo.split('. Descartados')[0]}")
+        else:
+            self.combo_formats.set("")
+            self.filename_preview.config(text="")
+            self.status_label.config(text="No se encontraron formatos de video‑only.")
+
+    def _show_error(self, msg: str, status: str | None = None) -> None:
+        messagebox.showerror("Error", msg)
+        self.play_sound("error")
+        if status is not None:
+            self.status_label.config(text=status)
+
+    def set_progress(self, percent: float, status: str) -> None:
+        self.progress["value"] = percent
+        self.status_label.config(text=status)
+
+    def show_thumbnail(self, thumbnail_url: str) -> None:
+        """Pide la miniatura en segundo plano; nunca bloquea al hilo que llama."""
+        self._thumbnail_url = thumbnail_url
+        self.thumbnails.request(thumbnail_url, lambda photo: self._set_thumbnail(thumbnail_url, photo))
+
+    def _set_thumbnail(self, thumbnail_url: str, photo) -> None:
+        if thumbnail_url != self._thumbnail_url:
+            return  # llegó tarde: ya se pidió otra miniatura
+        if photo is None:
+            self.show_default_gif()
+            return
+        self.gif_frames = []  # detiene la animación por defecto
+        self.current_thumbnail = photo
+        if hasattr(self, "thumbnail_label"):
+            self.thumbnail_label.config(image=photo)
+            self.thumbnail_label.image = photo
 
     # =============================================================
     #                       DESCARGA PRINCIPAL
@@ -551,286 +721,186 @@ class YouTubeDownloader(tk.Tk):
         if not urls:
             messagebox.showerror("Error", "Por favor ingresa al menos una URL válida.")
             return
+        if self.pipeline is not None:
+            messagebox.showinfo("Descarga en curso", "Espera a que termine el lote actual.")
+            return
         self.play_sound("click")
         self.progress["value"] = 0
         self.status_label.config(text="Preparando descarga...")
-        threading.Thread(target=lambda: self.download_multiple(urls), daemon=True).start()
 
-    def download_multiple(self, urls: list[str]) -> None:
+        # Las variables de Tk se leen aquí, en el hilo de la interfaz
+        jobs = []
         for idx, url in enumerate(urls, 1):
-            url = limpiar_url_video(url)
-            self.status_label.config(text=f"Descargando video {idx}/{len(urls)}...")
-            # Muestra el GIF por defecto antes de buscar la miniatura real
-            self.show_default_gif()
-            try:
-                ydl_opts = {"quiet": True, "skip_download": True}
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=False)
-                self.current_video_title = info.get("title", "video")
-                self.formats = []
-                seen_resolutions = set()
-                thumbnail_url = info.get("thumbnail")
-                # Si hay miniatura, intenta mostrarla
-                if thumbnail_url:
-                    try:
-                        from urllib.request import urlopen
-                        from io import BytesIO
-                        data = urlopen(thumbnail_url).read()
-                        img = Image.open(BytesIO(data)).resize((160, 90))
-                        photo = ImageTk.PhotoImage(img)
-                        self.current_thumbnail = photo
-                        self.thumbnail_label.config(image=photo)
-                        self.thumbnail_label.image = photo
-                    except Exception:
-                        self.show_default_gif()
-                else:
-                    self.show_default_gif()
-                for f in info.get("formats", []):
-                    acodec, vcodec = f.get("acodec"), f.get("vcodec")
-                    ext = f.get("ext")
-                    resolution = f.get("resolution") or (
-                        f.get("height") and f"{f.get('height')}p") or "?p"
-                    if acodec == "none" and vcodec != "none" and ext == "webm":
-                        if resolution in seen_resolutions:
-                            continue
-                        seen_resolutions.add(resolution)
-                        itag = f.get("format_id")
-                        filesize = f.get("filesize") or f.get("filesize_approx") or 0
-                        size_mb = round(filesize / (1024 * 1024), 2)
-                        desc = f"{resolution} — {ext.upper()} — {size_mb}MB (itag:{itag})"
-                        self.formats.append((desc, itag))
-                if self.formats:
-                    self.selected_format.set(self.formats[-1][0])
-                else:
-                    self.selected_format.set("")
-            except Exception as err:
-                messagebox.showerror("Error", f"No se pudo obtener formatos:\n{err}")
-                self.play_sound("error")
-                continue
-            self.download(url)
-        self.status_label.config(text="Todas las descargas finalizadas.")
-
-    def download(self, url: str) -> None:
-        desc_sel = self.selected_format.get()
-        itag = next((itag for desc, itag in self.formats if desc == desc_sel), None)
-        if not itag and not self.only_mp3.get():
-            messagebox.showerror("Error", "Formato de video inválido seleccionado.")
-            self.play_sound("error")
-            return
-
-        safe_title = "".join(c for c in self.current_video_title if c.isalnum() or c in " -_")
-        temp_dir = os.path.join(self.download_folder, "temp")
-        os.makedirs(temp_dir, exist_ok=True)
-        outtmpl_audio = os.path.join(temp_dir, f"{safe_title}.%(ext)s")
-        outtmpl_video = os.path.join(temp_dir, f"{safe_title}_video.%(ext)s")
-        ffmpeg_path = os.path.join(os.getcwd(), "ffmpeg_bin", "ffmpeg.exe")
-
-        ydl_opts_audio = {
-            "format": "bestaudio/best",
-            "outtmpl": outtmpl_audio,
-            "quiet": True,
-            "progress_hooks": [self.progress_hook],
-            "ffmpeg_location": ffmpeg_path
-        }
-
-        ydl_opts_video = {
-            "format": itag,
-            "outtmpl": outtmpl_video,
-            "quiet": True,
-            "progress_hooks": [self.progress_hook],
-            "ffmpeg_location": ffmpeg_path
-        }
-
-        fases = []
+            job = DownloadJob(idx, limpiar_url_video(url), only_mp3=self.only_mp3.get())
+            # En modo video único se respeta la resolución elegida en la lista
+            if self.modo_var.get() == "video" and job.url == self.formats_url:
+                desc_sel = self.selected_format.get()
+                job.itag = next((itag for desc, itag in self.formats if desc == desc_sel), None)
+                job.format_desc = desc_sel
+                job.info = self.formats_info
+            jobs.append(job)
+
+        # Muestra el GIF por defecto antes de buscar la miniatura real
+        self.show_default_gif()
+        self.jobs_list.delete(0, tk.END)
+        for job in jobs:
+            self.jobs_list.insert(tk.END, self._job_line(job))
+
+        engine = DownloadEngine(self.download_folder, self.encoder, encoder_preset=self.encoder_preset,
+                                on_update=self.on_job_update,
+                                prefer_h264=self.prefer_h264.get(),
+                                metadata_cache=self.metadata_cache,
+                                staging_dir=self.staging_folder,
+                                bandwidth=BandwidthManager(self._rate_limit()),
+                                encoder_fps=self._encoder_fps())
         if self.only_mp3.get():
-            fases = ["1/3 Descargando audio...", "2/3 Convirtiendo a MP3...", "3/3 Borrando temporales..."]
+            # Modo música: un encoder de MP3 por núcleo mientras siguen las descargas
+            self.pipeline = DownloadPipeline.for_music(engine, downloads=self.max_workers.get(),
+                                                       on_job_done=self.on_job_done)
         else:
-            fases = [
-                "1/6 Descargando audio...",
-                "2/6 Descargando video...",
-                "3/6 Convirtiendo video a MP4...",
-                "4/6 Convirtiendo audio a MP3...",
-                "5/6 Combinando video y audio...",
-                "6/6 Borrando temporales..."
-            ]
+            workers = {"fetch": self.max_workers.get(), "transcode": self.transcode_workers.get()}
+            self.pipeline = DownloadPipeline(engine, workers, on_job_done=self.on_job_done)
+        threading.Thread(target=self.download_multiple, args=(jobs,), daemon=True).start()
+
+    def _encoder_fps(self) -> float | None:
+        return encoder_speed(self.settings.get("encoder_probe"), self.encoder, self.encoder_preset)
 
-        self._start_time = time.time()
+    def _rate_limit(self) -> float | None:
         try:
-            # Fase 1: Descargar audio
-            self.status_label.config(text=fases[0])
-            with yt_dlp.YoutubeDL(ydl_opts_audio) as ydl:
-                info_audio = ydl.extract_info(url, download=True)
-                audio_file = ydl.prepare_filename(info_audio)
-
-            # Fase 2: Solo MP3 o Video+Audio
-            if self.only_mp3.get():
-                self.status_label.config(text=fases[1])
-                mp3_file = os.path.join(temp_dir, f"{safe_title}.mp3")
-                subprocess.run([
-                    ffmpeg_path, "-y", "-i", audio_file, "-vn", "-ab", "320k", "-ar", "44100", "-f", "mp3", mp3_file
-                ], check=True)
-                # Mueve el archivo final a la carpeta de descargas
-                shutil.move(mp3_file, os.path.join(self.download_folder, f"{safe_title}.mp3"))
-            else:
-                # Fase 2: Descargar video
-                self.status_label.config(text=fases[1])
-                with yt_dlp.YoutubeDL(ydl_opts_video) as ydl:
-                    info_video = ydl.extract_info(url, download=True)
-                    video_file = ydl.prepare_filename(info_video)
-
-                # Fase 3: Convertir video a MP4 (en temp)
-                self.status_label.config(text=fases[2])
-                mp4_file = os.path.join(temp_dir, f"{safe_title}.mp4")
-                cmd = [ffmpeg_path, "-y", "-i", video_file, "-c:v", self.encoder]
-                if self.encoder in ("libx264", "h264_nvenc"):
-                    cmd += ["-preset", "fast", "-crf", "22"]
-                cmd += ["-an", mp4_file]
-                subprocess.run(cmd, check=True)
-
-                # Fase 4: Convertir audio a MP3 (en temp)
-                self.status_label.config(text=fases[3])
-                mp3_file = os.path.join(temp_dir, f"{safe_title}.mp3")
-                subprocess.run([
-                    ffmpeg_path, "-y", "-i", audio_file, "-vn", "-ab", "320k", "-ar", "44100", "-f", "mp3", mp3_file
-                ], check=True)
-
-                # Fase 5: Combinar video y audio en un solo MP4 (en carpeta final)
-                self.status_label.config(text=fases[4])
-                final_file = os.path.join(self.download_folder, f"{safe_title}.mp4")
-                subprocess.run([
-                    ffmpeg_path, "-y",
-                    "-i", mp4_file,
-                    "-i", mp3_file,
-                    "-c:v", "copy",
-                    "-c:a", "aac",
-                    "-strict", "experimental",
-                    final_file
-                ], check=True)
-
-            # Fase final: Borrar temporales (borra los 4 archivos temporales)
-            self.status_label.config(text=fases[-1])
-            for f in os.listdir(temp_dir):
-                try:
-                    os.remove(os.path.join(temp_dir, f))
-                except Exception:
-                    pass
-            try:
-                os.rmdir(temp_dir)
-            except Exception:
-                pass
+            limite = self.rate_limit_mb.get()
+        except tk.TclError:  # texto no numérico en el spinbox
+            return None
+        return limite * 1024 * 1024 if limite > 0 else None
 
-            self.record_download(safe_title, desc_sel if not self.only_mp3.get() else "MP3")
-            messagebox.showinfo("Éxito", "Descarga completada con éxito!")
+    def download_multiple(self, jobs: list[DownloadJob]) -> None:
+        try:
+            self.pipeline.run(jobs)
+        finally:
+            self.ui.call(self._batch_finished, jobs)
+
+    def _batch_finished(self, jobs: list[DownloadJob]) -> None:
+        por_minuto = self.pipeline.progress()["per_minute"] if self.pipeline else 0.0
+        self.pipeline = None
+        ok = sum(1 for j in jobs if j.status == DownloadJob.COMPLETADO)
+        saltados = sum(1 for j in jobs if j.status == DownloadJob.SALTADO)
+        nota = f", {saltados} ya descargados" if saltados else ""
+        if ok and all(j.only_mp3 for j in jobs):
+            nota += f", {por_minuto:.1f} pistas/min"
+        # Dónde se fue el tiempo del lote (detalle por trabajo en .metrics/jobs.jsonl)
+        fases: dict[str, float] = {}
+        for j in jobs:
+            for fase, segundos in j.timings.items():
+                fases[fase] = fases.get(fase, 0.0) + segundos
+        tiempos = ", ".join(f"{fase} {seg:.0f}s" for fase, seg in sorted(fases.items(), key=lambda x: -x[1]))
+        self.metadata_cache.flush()
+        cache = self.metadata_cache.stats()
+        self.progress["value"] = 100 if ok or saltados else 0
+        self.status_label.config(
+            text=f"Todas las descargas finalizadas ({ok}/{len(jobs)} correctas{nota}).\n"
+                 f"Tiempo por fase: {tiempos or '-'}\n"
+                 f"Caché de metadatos: {cache['hits']} aciertos, {cache['misses']} fallos, "
+                 f"{cache['entries']} entradas"
+        )
+        if ok or saltados:
+            messagebox.showinfo("Éxito", f"Descargas completadas con éxito: {ok} de {len(jobs)}{nota}.")
             self.play_sound("success")
-            self.status_label.config(text=f"Descarga completada en {time.time() - self._start_time:.1f} segundos.")
-            self.progress["value"] = 100
 
-        except Exception as err:
-            messagebox.showerror("Error", f"Error durante la descarga:\n{err}")
-            self.play_sound("error")
-            self.status_label.config(text="Error en la descarga")
-            self.progress["value"] = 0
-
-    def progress_hook(self, d: dict) -> None:
-        if d["status"] == "downloading":
-            downloaded = d.get("downloaded_bytes", 0)
-            total = d.get("total_bytes") or d.get("total_bytes_estimate", 1)
-            percent = (downloaded / total) * 100 if total else 0
-
-            speed = d.get("speed") or 0  # <-- Cambia aquí: si es None, usa 0
-            speed_mb = speed / (1024 * 1024) if speed else 0
-
-            if self._start_time:
-                elapsed = time.time() - self._start_time
-                if speed > 0 and percent > 0:
-                    remaining = (total - downloaded) / speed
-                    time_str = f"{elapsed:.1f}s | {remaining:.1f}s restantes"
-                else:
-                    time_str = f"{elapsed:.1f}s"
-            else:
-                time_str = ""
-
-            self.progress["value"] = percent
-            self.status_label.config(
-                text=f"Descargando... {percent:.1f}% | {speed_mb:.1f} MB/s | {time_str}"
-            )
-            self.update_idletasks()
+    @staticmethod
+    def _job_line(job: DownloadJob) -> str:
+        name = job.title or job.url
+        if job.status == DownloadJob.EN_CURSO and job.encode:
+            e = job.encode
+            eta = f" ETA {e['eta']:.0f}s" if e["eta"] is not None else ""
+            return f"{job.index}. {name} — {job.phase} {job.percent:.0f}% {e['fps']:.0f} fps x{e['speed']:.1f}{eta}"
+        if job.status == DownloadJob.EN_CURSO:
+            return f"{job.index}. {name} — {job.phase} {job.percent:.0f}% {job.speed / (1024 * 1024):.1f} MB/s"
+        if job.status == DownloadJob.SALTADO:
+            return f"{job.index}. {name} — {job.status} (ya descargado)"
+        if job.status == DownloadJob.COMPLETADO and job.resumed:
+            return f"{job.index}. {name} — {job.status} (reanudado: {', '.join(job.resumed)})"
+        if job.status == DownloadJob.COMPLETADO and job.video_path:
+            modo = {"remux": "copia H.264", "chunked": "recodificado por trozos"}.get(job.video_path, "recodificado")
+            return f"{job.index}. {name} — {job.status} ({modo})"
+        return f"{job.index}. {name} — {job.status}"
+
+    def on_job_update(self, job: DownloadJob) -> None:
+        """Llamado desde los workers: solo publica en el bus, nunca toca widgets."""
+        if job.thumbnail_url and job.phase == "Obteniendo formatos...":
+            self.ui.call(self.show_thumbnail, job.thumbnail_url)
+        self.ui.post(("trabajo", job.index), self._refresh_job, job)
+        self.ui.post("lote", self._refresh_batch)
+
+    def _refresh_job(self, job: DownloadJob) -> None:
+        self.jobs_list.delete(job.index - 1)
+        self.jobs_list.insert(job.index - 1, self._job_line(job))
+
+    def _refresh_batch(self) -> None:
+        pipeline = self.pipeline
+        if pipeline is None:
+            return
+        resumen = pipeline.progress()
+        speed_mb = resumen["throughput"]["total"] / (1024 * 1024)
+        limite = resumen["throughput"]["limit"]
+        tope = f" (límite {limite / (1024 * 1024):.0f})" if limite else ""
+        colas = " ".join(f"{name}:{m['busy']}/{m['queued']}" for name, m in resumen["stages"].items())
+        ritmo = f" | {resumen['per_minute']:.1f}/min" if resumen["done"] else ""
+        self.set_progress(
+            resumen["percent"],
+            f"Lote {resumen['done'] + resumen['failed']}/{resumen['total']} | "
+            f"{resumen['percent']:.1f}% | {speed_mb:.1f} MB/s{tope}{ritmo}\n"
+            f"Etapas (activos/en cola): {colas}"
+        )
 
-    def record_download(self, title: str, formato: str) -> None:
-        """Guarda la descarga en el historial."""
-        entry = {
-            "fecha": time.strftime("%Y-%m-%d %H:%M"),
-            "titulo": title,
-            "formato": formato.split("—")[0].strip(),
-        }
-        
-        historial = []
-        if os.path.exists(HISTORIAL_FILE):
-            with open(HISTORIAL_FILE, "r", encoding="utf-8") as f:
-                try:
-                    historial = json.load(f)
-                except json.JSONDecodeError:
-                    historial = []
-        
-        historial.insert(0, entry)
-        with open(HISTORIAL_FILE, "w", encoding="utf-8") as f:
-            json.dump(historial, f, ensure_ascii=False, indent=2)
-
-    def progress_hook(self, d: dict) -> None:
-        if d["status"] == "downloading":
-            downloaded = d.get("downloaded_bytes", 0)
-            total = d.get("total_bytes") or d.get("total_bytes_estimate", 1)
-            percent = (downloaded / total) * 100 if total else 0
-            
-            speed = d.get("speed") or 0  # <-- Cambia aquí: si es None, usa 0
-            speed_mb = speed / (1024 * 1024) if speed else 0
-            
-            if self._start_time:
-                elapsed = time.time() - self._start_time
-                if speed > 0 and percent > 0:
-                    remaining = (total - downloaded) / speed
-                    time_str = f"{elapsed:.1f}s | {remaining:.1f}s restantes"
-                else:
-                    time_str = f"{elapsed:.1f}s"
-            else:
-                time_str = ""
-            
-            self.progress["value"] = percent
-            self.status_label.config(
-                text=f"Descargando... {percent:.1f}% | {speed_mb:.1f} MB/s | {time_str}"
-            )
-            self.update_idletasks()
+    def on_job_done(self, job: DownloadJob) -> None:
+        if job.status == DownloadJob.COMPLETADO:
+            self.record_download(job)
+        elif job.status == DownloadJob.ERROR:
+            self.ui.call(self._show_error,
+                         f"Error durante la descarga de {job.title or job.url}:\n{job.error}")
 
-    def record_download(self, title: str, formato: str) -> None:
+    def record_download(self, job: DownloadJob) -> None:
         """Guarda la descarga en el historial."""
-        entry = {
-            "fecha": time.strftime("%Y-%m-%d %H:%M"),
-            "titulo": title,
-            "formato": formato.split("—")[0].strip(),
-        }
-        
-        historial = []
-        if os.path.exists(HISTORIAL_FILE):
-            with open(HISTORIAL_FILE, "r", encoding="utf-8") as f:
-                try:
-                    historial = json.load(f)
-                except json.JSONDecodeError:
-                    historial = []
-        
-        historial.insert(0, entry)
-        with open(HISTORIAL_FILE, "w", encoding="utf-8") as f:
-            json.dump(historial, f, ensure_ascii=False, indent=2)
-
-    def ask_encoder_if_needed(self):
-        # Siempre pregunta al usuario qué encoder usar
-        self.select_encoder_dialog()
+        formato = "MP3" if job.only_mp3 else (job.format_desc or "").split("—")[0].strip()
+        self.history.add(job.safe_title, formato, extraer_video_id(job.url), job.url,
+                         job.output_file)
 
     def load_encoder(self):
-        if os.path.exists("config.txt"):
-            with open("config.txt", "r", encoding="utf-8") as f:
-                self.encoder = f.read().strip()
+        if self.settings.get("encoder"):
+            self.encoder = self.settings["encoder"]
+            self.encoder_preset = self.settings.get("encoder_preset")
         else:
+            # Primera ejecución: libx264 mientras se mide en segundo plano cuál va más rápido
             self.encoder = "libx264"
+            self.detect_encoder(show_results=False)
+
+    def detect_encoder(self, show_results: bool = True) -> None:
+        self.status_label.config(text="Probando encoders de video...")
+        threading.Thread(target=self._probe_encoders, args=(show_results,), daemon=True).start()
+
+    def _probe_encoders(self, show_results: bool) -> None:
+        results = probe_encoders(on_result=lambda r: self.ui.post(
+            "encoder", self._set_status,
+            f"Probando encoders: {r['encoder']} ({r['preset'] or 'por defecto'})..."))
+        self.ui.call(self._encoder_detected, results, show_results)
+
+    def _set_status(self, text: str) -> None:
+        self.status_label.config(text=text)
+
+    def _encoder_detected(self, results: list[dict], show_results: bool) -> None:
+        self.encoder, self.encoder_preset = best_encoder(results)
+        self.settings["encoder_probe"] = results
+        self.save_config()
+        self.status_label.config(text=f"Encoder de video: {self.encoder} ({self.encoder_preset or 'por defecto'})")
+        if show_results:
+            lineas = [
+                f"{r['encoder']} {r['preset'] or ''}: " + (f"{r['fps']:.0f} fps" if r["ok"] else "no funciona")
+                for r in results
+            ]
+            messagebox.showinfo(
+                "Encoders de video",
+                "\n".join(lineas or ["FFmpeg no está disponible."])
+                + f"\n\nSe usará: {self.encoder} ({self.encoder_preset or 'por defecto'})",
+            )
 
     def select_encoder_dialog(self):
         opciones = [
@@ -846,29 +916,26 @@ class YouTubeDownloader(tk.Tk):
         sel = simpledialog.askinteger("Configuración de encoder", msg, minvalue=1, maxvalue=len(opciones))
         if sel and 1 <= sel <= len(opciones):
             self.encoder = opciones[sel-1][0]
-            with open("config.txt", "w", encoding="utf-8") as f:
-                f.write(self.encoder)
-            messagebox.showinfo("Encoder guardado", f"Encoder '{self.encoder}' guardado en config.txt")
+            self.encoder_preset = None
+            self.save_config()
+            messagebox.showinfo("Encoder guardado", f"Encoder '{self.encoder}' guardado en {SETTINGS_FILE}")
         else:
-            # Si cancela, usa libx264 por defecto
-            self.encoder = "libx264"
-            with open("config.txt", "w", encoding="utf-8") as f:
-                f.write(self.encoder)
-            messagebox.showwarning("Sin cambios", "No se cambió el encoder. Se usará CPU (libx264).")
+            messagebox.showwarning("Sin cambios", f"No se cambió el encoder. Se usará {self.encoder}.")
 
-    # En el menú de configuración, llama a select_encoder_dialog para cambiar el encoder
     def create_menu(self) -> None:
         menubar = tk.Menu(self)
         self.config(menu=menubar)
 
         archivo_menu = tk.Menu(menubar, tearoff=0)
         archivo_menu.add_command(label="Seleccionar carpeta...", command=self.select_folder)
+        archivo_menu.add_command(label="Carpeta temporal...", command=self.select_staging_folder)
         archivo_menu.add_command(label="Ver historial", command=self.show_history)
         archivo_menu.add_separator()
         archivo_menu.add_command(label="Salir", command=self.destroy)
         menubar.add_cascade(label="Archivo", menu=archivo_menu)
 
         config_menu = tk.Menu(menubar, tearoff=0)
+        config_menu.add_command(label="Detectar encoder más rápido", command=self.detect_encoder)
         config_menu.add_command(label="Cambiar encoder de video...", command=self.select_encoder_dialog)
         menubar.add_cascade(label="Configuración", menu=config_menu)
 
@@ -901,6 +968,8 @@ class YouTubeDownloader(tk.Tk):
     def show_default_gif(self):
         gif_path = resource_path("img/1687179242748DOBkDGBBDUBKCLrB.gif")
         if os.path.exists(gif_path):
+            from PIL import Image, ImageTk, ImageSequence
+
             # Si es GIF animado, muestra la animación
             try:
                 self.gif_frames = [ImageTk.PhotoImage(img) for img in ImageSequence.Iterator(Image.open(gif_path))]
@@ -915,7 +984,7 @@ class YouTubeDownloader(tk.Tk):
             self.thumbnail_label.config(image=None)
 
     def animate_gif(self):
-        if hasattr(self, "gif_frames"):
+        if getattr(self, "gif_frames", None):
             frame = self.gif_frames[self.gif_frame_index]
             self.thumbnail_label.config(image=frame)
             self.thumbnail_label.image = frame
@@ -943,22 +1012,45 @@ class MultiFormatSelector(tk.Toplevel):
         # Aquí llamas a tu función de descarga con los formatos seleccionados
         self.destroy()
 
-def limpiar_url_video(url):
-    """
-    Extrae el ID de video de cualquier URL de YouTube y devuelve la URL limpia.
-    Compatible con videos normales, shorts y YouTube Music.
-    """
-    # Busca el ID de video (11 caracteres) en diferentes formatos de URL
-    patrones = [
-        r"(?:v=|\/)([A-Za-z0-9_-]{11})",  # v=ID o /ID
-    ]
-    for pat in patrones:
-        m = re.search(pat, url)
-        if m:
-            video_id = m.group(1)
-            return f"https://www.youtube.com/watch?v={video_id}"
-    return url  # Si no encuentra, regresa la original
+class HistoryWindow(tk.Toplevel):
+    """Historial paginado: solo se leen de la base de datos las filas de la página."""
+
+    PAGE_SIZE = 50
+
+    def __init__(self, master, history: DownloadHistory):
+        super().__init__(master)
+        self.title("Historial de Descargas")
+        self.geometry("640x420")
+        self.history = history
+        self.offset = 0
+
+        self.tree = ttk.Treeview(self, columns=("fecha", "titulo", "formato"), show="headings")
+        for col, text, width in (("fecha", "Fecha", 130), ("titulo", "Título", 380), ("formato", "Formato", 100)):
+            self.tree.heading(col, text=text)
+            self.tree.column(col, width=width, anchor="w")
+        self.tree.pack(fill="both", expand=True, padx=5, pady=5)
+
+        nav = tk.Frame(self)
+        nav.pack(pady=5)
+        tk.Button(nav, text="< Anteriores", command=lambda: self.show_page(self.offset - self.PAGE_SIZE)).pack(side="left", padx=5)
+        self.page_label = tk.Label(nav, text="")
+        self.page_label.pack(side="left", padx=5)
+        tk.Button(nav, text="Siguientes >", command=lambda: self.show_page(self.offset + self.PAGE_SIZE)).pack(side="left", padx=5)
+        self.show_page(0)
+
+    def show_page(self, offset: int) -> None:
+        total = self.history.count()
+        if offset < 0 or offset >= total:
+            return
+        self.offset = offset
+        self.tree.delete(*self.tree.get_children())
+        for d in self.history.page(offset, self.PAGE_SIZE):
+            self.tree.insert("", "end", values=(d["fecha"], d["titulo"], d["formato"]))
+        fin = min(offset + self.PAGE_SIZE, total)
+        self.page_label.config(text=f"{offset + 1}-{fin} de {total}")
+
 
 if __name__ == "__main__":
     app = YouTubeDownloader()
     app.mainloop()
+    app.metadata_cache.flush()  # las entradas nuevas que no llegaron a guardarse
@@ -0,0 +1,95 @@
+"""
+Benchmark de la recodificación por trozos en paralelo frente a un solo proceso.
+
+Genera con lavfi videos sintéticos (MPEG-4 Part 2, que no es H.264 y obliga a
+recodificar) de varias duraciones, con audio Opus aparte como los que baja
+yt-dlp, y mide el tiempo real de:
+
+- single: una pasada de FFmpeg (mux_command, el camino normal).
+- chunked: chunked_encode (trozos en keyframes, pool de procesos, concat).
+
+Uso:
+    python benchmarks/bench_chunked_transcode.py --durations 30 120 300
+    python benchmarks/bench_chunked_transcode.py --ffmpeg /usr/bin/ffmpeg --workers 8
+
+La ganancia depende de los núcleos: con 1-2 núcleos el modo por trozos no
+mejora (y paga el corte y la unión).
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zking_core import (  # noqa: E402
+    chunked_encode,
+    ffmpeg_executable,
+    media_duration,
+    mux_command,
+    video_encode_args,
+)
+
+
+def make_source(ffmpeg: str, folder: str, seconds: float, size: str) -> tuple[str, str]:
+    video = os.path.join(folder, f"src_{seconds:g}.mkv")
+    audio = os.path.join(folder, f"src_{seconds:g}.webm")
+    subprocess.run([ffmpeg, "-y", "-v", "error", "-f", "lavfi",
+                    "-i", f"testsrc2=size={size}:rate=30", "-t", str(seconds),
+                    "-c:v", "mpeg4", "-q:v", "4", "-g", "60", video], check=True)
+    subprocess.run([ffmpeg, "-y", "-v", "error", "-f", "lavfi", "-i", "sine=f=440",
+                    "-t", str(seconds), "-c:a", "libopus", audio], check=True)
+    return video, audio
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--durations", type=float, nargs="+", default=[30, 120, 300])
+    parser.add_argument("--size", default="1280x720")
+    parser.add_argument("--ffmpeg", default=None)
+    parser.add_argument("--encoder", default="libx264")
+    parser.add_argument("--preset", default="fast")
+    parser.add_argument("--segment-seconds", type=float, default=30)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    ffmpeg = args.ffmpeg or ffmpeg_executable()
+    video_args = video_encode_args(args.encoder, args.preset)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for seconds in args.durations:
+            video, audio = make_source(ffmpeg, tmp, seconds, args.size)
+
+            single = os.path.join(tmp, "single.mp4")
+            t0 = time.perf_counter()
+            cmd = mux_command(ffmpeg, video, audio, single, video_args)
+            subprocess.run([cmd[0], "-v", "error", *cmd[1:]], check=True)
+            t_single = time.perf_counter() - t0
+
+            chunked = os.path.join(tmp, "chunked.mp4")
+            t0 = time.perf_counter()
+            trozos = chunked_encode(ffmpeg, video, audio, chunked, video_args,
+                                    os.path.join(tmp, f"trozos_{seconds:g}"),
+                                    args.segment_seconds, args.workers)
+            t_chunked = time.perf_counter() - t0
+
+            results.append({
+                "duration_s": seconds,
+                "single_s": round(t_single, 2),
+                "chunked_s": round(t_chunked, 2),
+                "segments": trozos,
+                "speedup": round(t_single / t_chunked, 2),
+                "chunked_duration_s": media_duration(ffmpeg, chunked),
+            })
+    print(json.dumps({"cpus": os.cpu_count(), "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""
+Benchmark de extremo a extremo del pipeline de descarga, sin conexión a YouTube.
+
+Genera con lavfi fuentes sintéticas (video VP9 en WebM o H.264 en MP4 según el
+escenario, y audio Opus en WebM). Las sirve desde un servidor HTTP local con
+Range y las expone a yt-dlp mediante un extractor de prueba
+(LocalStubIE) inyectado con DownloadEngine(ydl_factory=...). Así se ejecutan
+las fases reales: metadata, descarga de audio y video, mux/recodificación y
+limpieza.
+
+Cada escenario (tamaño de lote x resolución x encoder) se ejecuta en un proceso
+propio y se informa de:
+
+- tiempo total del lote y tiempo medio por fase,
+- tiempo de CPU de Python y de los procesos FFmpeg,
+- pico de memoria (RSS) de Python y del FFmpeg que más usó.
+
+El encoder "copy" sirve video H.264 (remux sin recodificar). Cualquier otro
+valor ("libx264", "h264_nvenc", ...) sirve VP9, que obliga a recodificar con ese
+encoder.
+
+Uso:
+    python benchmarks/bench_pipeline.py --batch-sizes 1 4 --resolutions 360 720
+    python benchmarks/bench_pipeline.py --encoders copy libx264 --duration 20 --ffmpeg /usr/bin/ffmpeg
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+RESOLUTIONS = {240: "426x240", 360: "640x360", 480: "854x480", 720: "1280x720", 1080: "1920x1080"}
+
+
+# ---------- fuentes sintéticas ---------- #
+
+def make_sources(ffmpeg: str, folder: str, height: int, seconds: float) -> dict[str, str]:
+    """Crea (si no existen) video VP9, video H.264 y audio Opus para una resolución."""
+    size = RESOLUTIONS[height]
+    paths = {
+        "vp9": os.path.join(folder, f"video_{height}.webm"),
+        "h264": os.path.join(folder, f"video_{height}.mp4"),
+        "opus": os.path.join(folder, "audio.webm"),
+    }
+    lavfi = ["-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30", "-t", str(seconds)]
+    comandos = {
+        "vp9": [*lavfi, "-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8",
+                "-b:v", "1M", "-g", "60"],
+        "h264": [*lavfi, "-c:v", "libx264", "-preset", "veryfast", "-g", "60",
+                 "-pix_fmt", "yuv420p"],
+        "opus": ["-f", "lavfi", "-i", "sine=f=440", "-t", str(seconds), "-c:a", "libopus",
+                 "-b:a", "128k"],
+    }
+    for key, path in paths.items():
+        if not os.path.exists(path):
+            subprocess.run([ffmpeg, "-y", "-v", "error", *comandos[key], path], check=True)
+    return paths
+
+
+# ---------- extractor de prueba ---------- #
+
+def stub_factory(catalog: dict):
+    """ydl_factory que crea YoutubeDL solo con LocalStubIE (sin extractores reales)."""
+    import yt_dlp
+    from yt_dlp.extractor.common import InfoExtractor
+
+    class LocalStubIE(InfoExtractor):
+        IE_NAME = "zking:local"
+        _VALID_URL = r"http://127\.0\.0\.1:\d+/watch\?v=(?P<id>[\w-]{11})"
+
+        def _real_extract(self, url):
+            video_id = self._match_id(url)
+            return {
+                "id": video_id,
+                "title": f"Bench {video_id}",
+                "duration": catalog["duration"],
+                "formats": [dict(f) for f in catalog["formats"]],
+            }
+
+    def factory(opts: dict):
+        ydl = yt_dlp.YoutubeDL(opts, auto_init=False)
+        ydl.add_info_extractor(LocalStubIE())
+        return ydl
+
+    return factory
+
+
+# ---------- un escenario (proceso hijo) ---------- #
+
+def run_scenario(sc: dict) -> dict:
+    import resource
+
+    from bench_segmented_download import start_server
+    from zking_core import DownloadEngine, DownloadJob, DownloadPipeline
+
+    video_key = "h264" if sc["encoder"] == "copy" else "vp9"
+    files = {"/video": open(sc["sources"][video_key], "rb").read(),
+             "/audio": open(sc["sources"]["opus"], "rb").read()}
+    server = start_server(files)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    catalog = {
+        "duration": sc["duration"],
+        "formats": [
+            {"format_id": "251", "url": f"{base}/audio", "ext": "webm", "protocol": "http",
+             "acodec": "opus", "vcodec": "none", "abr": 128, "filesize": len(files["/audio"])},
+            {"format_id": f"v{sc['height']}", "url": f"{base}/video", "protocol": "http",
+             "ext": "mp4" if video_key == "h264" else "webm",
+             "vcodec": "avc1.64001f" if video_key == "h264" else "vp9", "acodec": "none",
+             "height": sc["height"], "width": int(RESOLUTIONS[sc["height"]].split("x")[0]),
+             "filesize": len(files["/video"])},
+        ],
+    }
+
+    engine = DownloadEngine(
+        os.path.join(sc["workdir"], "out"),
+        "libx264" if sc["encoder"] == "copy" else sc["encoder"],
+        staging_dir=os.path.join(sc["workdir"], "staging"),
+        prefer_h264=video_key == "h264",
+        ydl_factory=stub_factory(catalog),
+    )
+    jobs = [DownloadJob(i, f"{base}/watch?v=bench{i:06d}") for i in range(1, sc["batch"] + 1)]
+    t0 = time.perf_counter()
+    DownloadPipeline(engine).run(jobs)
+    wall = time.perf_counter() - t0
+    server.shutdown()
+
+    fases: dict[str, list[float]] = {}
+    for job in jobs:
+        for fase, segundos in job.timings.items():
+            fases.setdefault(fase, []).append(segundos)
+    yo = resource.getrusage(resource.RUSAGE_SELF)
+    hijos = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    a_mb = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024
+    return {
+        "batch": sc["batch"],
+        "height": sc["height"],
+        "encoder": sc["encoder"],
+        "ok": sum(1 for j in jobs if j.status == DownloadJob.COMPLETADO),
+        "errors": sorted({str(j.error) for j in jobs if j.error})[:3],
+        "total_s": round(wall, 2),
+        "phase_mean_s": {k: round(sum(v) / len(v), 3) for k, v in sorted(fases.items())},
+        "cpu_python_s": round(yo.ru_utime + yo.ru_stime, 2),
+        "cpu_ffmpeg_s": round(hijos.ru_utime + hijos.ru_stime, 2),
+        "peak_rss_python_mb": round(yo.ru_maxrss * a_mb, 1),
+        "peak_rss_ffmpeg_mb": round(hijos.ru_maxrss * a_mb, 1),
+    }
+
+
+# ---------- orquestación ---------- #
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[360, 720],
+                        choices=sorted(RESOLUTIONS))
+    parser.add_argument("--encoders", nargs="+", default=["copy", "libx264"])
+    parser.add_argument("--duration", type=float, default=10, help="segundos de cada video")
+    parser.add_argument("--ffmpeg", default=None, help="ruta de ffmpeg (por defecto la del PATH)")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)  # uso interno: proceso hijo
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(json.loads(args.scenario))))
+        return 0
+
+    from zking_core import ffmpeg_executable
+
+    ffmpeg = os.path.abspath(args.ffmpeg) if args.ffmpeg else ffmpeg_executable()
+    env = dict(os.environ, PATH=os.path.dirname(ffmpeg) + os.pathsep + os.environ.get("PATH", ""))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for height in args.resolutions:
+            sources = make_sources(ffmpeg, tmp, height, args.duration)
+            for encoder in args.encoders:
+                for batch in args.batch_sizes:
+                    workdir = tempfile.mkdtemp(dir=tmp)
+                    sc = {"batch": batch, "height": height, "encoder": encoder,
+                          "duration": args.duration, "sources": sources, "workdir": workdir}
+                    proc = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--scenario", json.dumps(sc)],
+                        cwd=workdir, env=env, capture_output=True, text=True,
+                    )
+                    if proc.returncode != 0:
+                        print(proc.stderr.strip()[-500:], file=sys.stderr)
+                        continue
+                    results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+                    print(json.dumps(results[-1]), file=sys.stderr)  # avance
+    print(json.dumps({"cpus": os.cpu_count(), "duration_s": args.duration, "results": results},
+                     indent=2))
+    return 0 if all(r["ok"] == r["batch"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Benchmark de la descarga segmentada (SegmentedDownloader) contra un servidor local.
+
+Levanta un servidor HTTP con soporte de Range que limita la velocidad de cada
+conexión (como hacen los CDN con un solo flujo) y que, opcionalmente, corta
+respuestas a mitad para forzar reintentos. Descarga el mismo archivo con 1 y con
+N conexiones y comprueba el SHA-256 del resultado.
+
+Uso:
+    python benchmarks/bench_segmented_download.py --size-mb 16 --per-conn-kbps 2048
+    python benchmarks/bench_segmented_download.py --connections 8 --fail-rate 0.2
+
+Termina con código 1 si algún archivo descargado no coincide con el original.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zking_core import SegmentedDownloader  # noqa: E402
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Sirve `server.files` ({ruta: bytes}) con Range, a `server.per_conn_bps` por conexión."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        data = self.server.files.get(urlsplit(self.path).path)
+        if data is None:
+            self.send_error(404)
+            return
+        start, end = 0, len(data) - 1
+        rango = self.headers.get("Range")
+        if rango and rango.startswith("bytes="):
+            inicio, _, fin = rango[6:].partition("-")
+            start, end = int(inicio), min(int(fin or end), end)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+        cortar = self.server.rng.random() < self.server.fail_rate and end - start > 1
+        limite = start + (end - start) // 2 if cortar else end + 1
+        pos, chunk, t0 = start, 64 * 1024, time.monotonic()
+        while pos < min(limite, end + 1):
+            n = min(chunk, limite - pos, end + 1 - pos)
+            self.wfile.write(data[pos:pos + n])
+            pos += n
+            if self.server.per_conn_bps:
+                # Duerme lo necesario para no pasar de la velocidad por conexión
+                adelanto = (pos - start) / self.server.per_conn_bps - (time.monotonic() - t0)
+                if adelanto > 0:
+                    time.sleep(adelanto)
+        if cortar:
+            self.close_connection = True  # respuesta incompleta: el cliente debe reintentar
+
+
+def start_server(files: dict[str, bytes], per_conn_bps: float = 0, fail_rate: float = 0.0,
+                 seed: int = 1) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    server.daemon_threads = True
+    server.files = files
+    server.per_conn_bps = per_conn_bps
+    server.fail_rate = fail_rate
+    server.rng = random.Random(seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(url: str, path: str, connections: int, expected: str) -> dict:
+    t0 = time.perf_counter()
+    SegmentedDownloader(url, path, connections=connections, segment_bytes=1024 * 1024,
+                        retries=10).download()
+    segundos = time.perf_counter() - t0
+    with open(path, "rb") as f:
+        ok = hashlib.sha256(f.read()).hexdigest() == expected
+    size = os.path.getsize(path)
+    return {
+        "connections": connections,
+        "seconds": round(segundos, 2),
+        "mb_s": round(size / (1024 * 1024) / segundos, 2),
+        "sha256_ok": ok,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=float, default=16)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--per-conn-kbps", type=float, default=2048,
+                        help="velocidad máxima por conexión en KB/s (0 = sin límite)")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="probabilidad de cortar una respuesta a mitad")
+    args = parser.parse_args()
+
+    payload = os.urandom(int(args.size_mb * 1024 * 1024))
+    expected = hashlib.sha256(payload).hexdigest()
+    server = start_server({"/stream.bin": payload}, args.per_conn_kbps * 1024, args.fail_rate)
+    url = f"http://127.0.0.1:{server.server_address[1]}/stream.bin"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [measure(url, os.path.join(tmp, f"{n}.bin"), n, expected)
+                   for n in sorted({1, args.connections})]
+    server.shutdown()
+
+    print(json.dumps(results, indent=2))
+    return 0 if all(r["sha256_ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
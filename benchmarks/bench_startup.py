@@ -0,0 +1,100 @@
+"""
+Benchmark de arranque de ZkingDownload.
+
+Mide, en procesos nuevos para que no influya la caché de imports:
+
+- ventana: tiempo hasta que la ventana principal está creada y dibujada
+  (YouTubeDownloader() + update()). Necesita una pantalla (DISPLAY en Linux).
+- headless: tiempo hasta que el modo sin interfaz está listo (import de
+  zking_cli y construcción del parser).
+
+Uso:
+    python benchmarks/bench_startup.py --runs 5
+    python benchmarks/bench_startup.py --max-window-ms 1500 --max-headless-ms 300
+
+Con --max-*-ms el script termina con código 1 si la mediana supera el límite,
+para detectar regresiones en CI.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cada fragmento imprime los milisegundos medidos dentro del proceso hijo
+WINDOW_SNIPPET = """
+import time
+t0 = time.perf_counter()
+import ZkingDownload
+app = ZkingDownload.YouTubeDownloader()
+app.update()
+print((time.perf_counter() - t0) * 1000)
+app.destroy()
+"""
+
+HEADLESS_SNIPPET = """
+import time
+t0 = time.perf_counter()
+import zking_cli
+zking_cli.build_parser()
+print((time.perf_counter() - t0) * 1000)
+"""
+
+
+def measure(snippet: str, runs: int) -> dict | None:
+    """Ejecuta el fragmento `runs` veces; devuelve mediana/mín/máx o None si falla."""
+    in_process, wall = [], []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-c", snippet], cwd=REPO_DIR,
+                              capture_output=True, text=True)
+        elapsed = (time.perf_counter() - t0) * 1000
+        if proc.returncode != 0:
+            print(proc.stderr.strip().splitlines()[-1] if proc.stderr else "error", file=sys.stderr)
+            return None
+        in_process.append(float(proc.stdout.strip().splitlines()[-1]))
+        wall.append(elapsed)
+    return {
+        "median_ms": round(statistics.median(in_process), 1),
+        "min_ms": round(min(in_process), 1),
+        "max_ms": round(max(in_process), 1),
+        "process_median_ms": round(statistics.median(wall), 1),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-window-ms", type=float)
+    parser.add_argument("--max-headless-ms", type=float)
+    args = parser.parse_args()
+
+    results = {
+        "window": measure(WINDOW_SNIPPET, args.runs),
+        "headless": measure(HEADLESS_SNIPPET, args.runs),
+    }
+    print(json.dumps(results, indent=2))
+
+    failed = False
+    for key, limit in (("window", args.max_window_ms), ("headless", args.max_headless_ms)):
+        if limit is None:
+            continue
+        if results[key] is None:
+            # Sin medida no se puede dar el límite por cumplido
+            print(f"FALLO: {key} no se pudo medir (límite {limit} ms)", file=sys.stderr)
+            failed = True
+        elif results[key]["median_ms"] > limit:
+            print(f"REGRESIÓN: {key} {results[key]['median_ms']} ms > {limit} ms", file=sys.stderr)
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""FFmpegBootstrap contra el servidor HTTP local con Range de los benchmarks."""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import os
+import sys
+import zipfile
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+
+from bench_segmented_download import start_server  # noqa: E402
+from zking_core import FFmpegBootstrap  # noqa: E402
+
+EXE = os.urandom(600_000)
+
+
+def _zip() -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as z:
+        z.writestr("ffmpeg-7.1-essentials_build/doc/ffmpeg.exe", b"no es este")
+        z.writestr("ffmpeg-7.1-essentials_build/bin/ffprobe.exe", os.urandom(1000))
+        z.writestr("ffmpeg-7.1-essentials_build/bin/ffmpeg.exe", EXE)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def servidor():
+    data = _zip()
+    files = {
+        "/ffmpeg.zip": data,
+        "/ffmpeg.zip.sha256": f"{hashlib.sha256(data).hexdigest()}  ffmpeg.zip\n".encode(),
+        "/version": b"7.1\n",
+    }
+    server = start_server(files)
+    server.base = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+
+
+def _bootstrap(servidor, tmp_path, **kwargs) -> FFmpegBootstrap:
+    kwargs.setdefault("version_url", servidor.base + "/version")
+    return FFmpegBootstrap(str(tmp_path / "ffmpeg_bin"), servidor.base + "/ffmpeg.zip",
+                           retries=10, **kwargs)
+
+
+def test_instala_solo_el_ejecutable_de_bin(servidor, tmp_path):
+    b = _bootstrap(servidor, tmp_path)
+    os.makedirs(b.cache_dir)
+    viejo = os.path.join(b.cache_dir, "ffmpeg-7.0-essentials.zip")
+    open(viejo, "wb").close()
+
+    path = b.install()
+
+    with open(path, "rb") as f:
+        assert f.read() == EXE
+    assert sorted(os.listdir(b.install_dir)) == ["cache", "ffmpeg.exe"]
+    assert os.listdir(b.cache_dir) == ["ffmpeg-7.1-essentials.zip"]  # versión vieja podada
+
+
+def test_retoma_el_part_y_los_cortes(servidor, tmp_path):
+    avance = []
+    b = _bootstrap(servidor, tmp_path, on_progress=lambda leido, total: avance.append((leido, total)))
+    os.makedirs(b.cache_dir)
+    data = servidor.files["/ffmpeg.zip"]
+    ya = len(data) - 50_000  # más que un bloque de lectura: desde 0 no se llegaría aquí
+    with open(b.archive_path("7.1") + ".part", "wb") as f:
+        f.write(data[:ya])
+    servidor.fail_rate = 0.5  # corta respuestas a mitad
+
+    b.install()
+
+    assert avance[0][0] > ya  # siguió desde el .part, no desde el byte 0
+    assert avance[-1] == (len(data), len(data))
+    with open(b.archive_path("7.1"), "rb") as f:
+        assert f.read() == data
+
+
+def test_sin_version_conserva_el_part(servidor, tmp_path):
+    avance = []
+    b = _bootstrap(servidor, tmp_path, version_url=servidor.base + "/no-existe",
+                   on_progress=lambda leido, total: avance.append(leido))
+    os.makedirs(b.cache_dir)
+    ya = len(servidor.files["/ffmpeg.zip"]) - 50_000
+    with open(b.archive_path("7.1") + ".part", "wb") as f:
+        f.write(servidor.files["/ffmpeg.zip"][:ya])
+
+    b.install()
+
+    assert avance[0] > ya
+    assert os.listdir(b.cache_dir) == ["ffmpeg-7.1-essentials.zip"]
+
+
+def test_cache_valida_no_se_vuelve_a_bajar(servidor, tmp_path):
+    b = _bootstrap(servidor, tmp_path)
+    path = b.install()
+    os.remove(path)
+    avance = []
+    b.on_progress = lambda leido, total: avance.append(leido)
+
+    assert b.install() == path
+    assert avance == []
+
+
+def test_checksum_distinto_descarta_el_zip(servidor, tmp_path):
+    servidor.files["/ffmpeg.zip.sha256"] = b"0" * 64
+    b = _bootstrap(servidor, tmp_path)
+
+    with pytest.raises(ValueError):
+        b.install()
+    assert os.listdir(b.cache_dir) == []
+    assert not os.path.exists(b.target)
@@ -0,0 +1,48 @@
+"""Elección de formato por coste (format_cost / rank_video_formats)."""
+
+from __future__ import annotations
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zking_core import format_cost, select_video_format, video_only_formats  # noqa: E402
+
+
+def _formato(format_id, height, vcodec, ext, **extra):
+    return {"format_id": format_id, "height": height, "width": height * 16 // 9, "ext": ext,
+            "vcodec": vcodec, "acodec": "none", "fps": 30, **extra}
+
+
+def test_format_cost_sin_duracion_ni_tamano():
+    # Directo o estreno: yt-dlp da bitrate pero ni filesize ni duration
+    f = _formato("247", 720, "vp9", "webm", tbr=1500)
+    coste = format_cost(f, None)
+    assert coste["bytes"] == 0
+    assert coste["bytes_estimated"]
+    assert coste["cost_s"] == 0
+
+
+def test_listado_y_eleccion_con_info_sin_duracion():
+    info = {"duration": None, "formats": [
+        _formato("247", 720, "vp9", "webm", tbr=1500),
+        _formato("136", 720, "avc1.4d401f", "mp4", vbr=2000),
+        {"format_id": "251", "ext": "webm", "vcodec": "none", "acodec": "opus", "tbr": 130},
+    ]}
+    assert [itag for _desc, itag in video_only_formats(info)] == ["136"]
+    elegido, motivo = select_video_format(info)
+    assert elegido["format_id"] == "136" and elegido["remux"]
+    assert "itag 136" in motivo
+
+
+def test_remux_gana_a_recodificar_en_la_misma_resolucion():
+    info = {"duration": 300, "formats": [
+        _formato("247", 720, "vp9", "webm", filesize=40_000_000),
+        _formato("136", 720, "avc1.4d401f", "mp4", filesize=50_000_000),
+        _formato("137", 1080, "avc1.640028", "mp4", filesize=90_000_000),
+    ]}
+    elegido, _ = select_video_format(info, max_height=720)
+    assert elegido["format_id"] == "136"
+    elegido, motivo = select_video_format(info, max_height=480)
+    assert elegido["format_id"] in ("136", "247") and "nada cabe en 480p" in motivo
@@ -0,0 +1,87 @@
+"""SegmentedDownloader contra el servidor HTTP local con Range de los benchmarks."""
+
+from __future__ import annotations
+
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "benchmarks"))
+
+from bench_segmented_download import RangeHandler, start_server  # noqa: E402
+from zking_core import RangeNotSupported, SegmentedDownloader  # noqa: E402
+
+DATA = os.urandom(4 * 1024 * 1024)
+SEGMENTO = 256 * 1024
+
+
+class SinRange(RangeHandler):
+    """Ignora la cabecera Range y responde siempre 200 con el archivo entero."""
+
+    def do_GET(self) -> None:
+        del self.headers["Range"]
+        super().do_GET()
+
+
+@pytest.fixture
+def servidor():
+    server = start_server({"/stream.bin": DATA})
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/stream.bin"
+    yield server
+    server.shutdown()
+
+
+def _downloader(servidor, tmp_path, avance: list, **kwargs) -> SegmentedDownloader:
+    kwargs.setdefault("retries", 20)
+    return SegmentedDownloader(servidor.url, str(tmp_path / "video.mp4"), connections=4,
+                               segment_bytes=SEGMENTO, on_progress=avance.append, **kwargs)
+
+
+def test_los_cortes_no_cuentan_dos_veces(servidor, tmp_path):
+    servidor.fail_rate = 0.5  # corta respuestas a mitad
+    avance = []
+
+    path = _downloader(servidor, tmp_path, avance).download()
+
+    assert sum(avance) == len(DATA)
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert os.listdir(tmp_path) == ["video.mp4"]
+
+
+def test_retoma_solo_los_rangos_que_faltan(servidor, tmp_path):
+    mitad = len(DATA) // 2
+    avance = []
+
+    def cortar(nbytes: int) -> None:
+        avance.append(nbytes)
+        if sum(avance) > mitad:
+            raise OSError("cortado")
+
+    primero = SegmentedDownloader(servidor.url, str(tmp_path / "video.mp4"), connections=1,
+                                  segment_bytes=SEGMENTO, retries=0, on_progress=cortar)
+    with pytest.raises(OSError):
+        primero.download()
+    assert not os.path.exists(tmp_path / "video.mp4")
+
+    avance = []
+    path = _downloader(servidor, tmp_path, avance).download()
+
+    assert avance[0] == mitad  # los rangos completos del intento anterior
+    assert sum(avance) == len(DATA)
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert os.listdir(tmp_path) == ["video.mp4"]
+
+
+def test_sin_range_no_crea_archivos(servidor, tmp_path):
+    servidor.RequestHandlerClass = SinRange
+    avance = []
+
+    with pytest.raises(RangeNotSupported):
+        _downloader(servidor, tmp_path, avance).download()
+    assert avance == []
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,222 @@
+"""
+Modo sin interfaz de ZkingDownload para servidores y lotes.
+
+No importa Tk, pygame ni PIL: usa el mismo motor (zking_core) que la ventana.
+El avance se escribe en stdout como una línea JSON por evento, por ejemplo:
+
+    python zking_cli.py lista.txt -o descargas -j 4 --formato 720
+
+Códigos de salida: 0 todo correcto, 1 alguna descarga falló, 2 argumentos o
+lista de URLs inválidos.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from zking_core import (
+    MAX_WORKERS_DEFAULT,
+    BandwidthManager,
+    DownloadEngine,
+    DownloadJob,
+    DownloadPipeline,
+    MetadataCache,
+    MetricsRecorder,
+    best_encoder,
+    encoder_speed,
+    limpiar_url_video,
+    load_settings,
+    probe_encoders,
+    save_settings,
+)
+
+EXIT_OK = 0
+EXIT_FALLOS = 1
+EXIT_USO = 2
+
+
+class JsonProgress:
+    """Escribe eventos JSON por línea; limita el avance de cada trabajo a `interval` s."""
+
+    def __init__(self, stream=None, interval: float = 0.5,
+                 bandwidth: BandwidthManager | None = None) -> None:
+        self.stream = stream or sys.stdout
+        self.interval = interval
+        self.bandwidth = bandwidth
+        self._last: dict[int, tuple[float, str, str]] = {}
+        self._lock = threading.Lock()
+
+    def emit(self, event: str, **data) -> None:
+        line = json.dumps({"event": event, "time": round(time.time(), 3), **data}, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def on_update(self, job: DownloadJob) -> None:
+        now = time.time()
+        last_time, last_status, last_phase = self._last.get(job.index, (0.0, "", ""))
+        # Los cambios de estado o fase siempre se emiten; el avance, a ritmo limitado
+        if job.status == last_status and job.phase == last_phase and now - last_time < self.interval:
+            return
+        self._last[job.index] = (now, job.status, job.phase)
+        self.emit("progress", index=job.index, url=job.url, title=job.title,
+                  status=job.status, phase=job.phase, percent=round(job.percent, 1),
+                  downloaded_bytes=job.downloaded_bytes, total_bytes=job.total_bytes,
+                  speed=job.speed, throughput=self._throughput(job), encode=job.encode or None)
+
+    def _throughput(self, job: DownloadJob) -> float | None:
+        """Velocidad real del trabajo medida por el gestor de ancho de banda."""
+        if self.bandwidth is None:
+            return None
+        return round(self.bandwidth.throughput()["jobs"].get(job.index, 0.0))
+
+    def on_job_done(self, job: DownloadJob) -> None:
+        self.emit("job", index=job.index, url=job.url, title=job.title, status=job.status,
+                  output=job.output_file, video_path=job.video_path,
+                  format=job.itag, format_reason=job.format_reason or None,
+                  seconds=round(job.elapsed, 2), encode=job.encode_stats or None,
+                  phases={k: round(v, 3) for k, v in job.timings.items()},
+                  error=str(job.error) if job.error else None)
+
+
+def read_urls(path: str) -> list[str]:
+    """Lee una URL por línea (ignora vacías y comentarios #); '-' lee de stdin."""
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    return [u.strip() for u in lines if u.strip() and not u.strip().startswith("#")]
+
+
+def parse_format_policy(value: str) -> tuple[bool, int | None]:
+    """'max' (mayor resolución), 'h264' (mayor H.264 remuxeable) o una altura máxima ('720')."""
+    value = value.lower().rstrip("p")
+    if value == "max":
+        return False, None
+    if value == "h264":
+        return True, None
+    if value.isdigit():
+        return False, int(value)
+    raise argparse.ArgumentTypeError(f"política de formato no válida: {value}")
+
+
+def parse_rate(value: str) -> float:
+    """Velocidad en bytes/s con sufijo opcional K/M/G: '500K', '4M', '4MB/s'."""
+    # Primero "/s" y luego "B": al revés, "4MB/s" se quedaba en "4MB"
+    numero = value.strip().upper().removesuffix("/S").removesuffix("B")
+    mult = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}.get(numero[-1:], 1)
+    try:
+        rate = float(numero.rstrip("KMG")) * mult
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"velocidad no válida: {value}") from None
+    if rate <= 0:
+        raise argparse.ArgumentTypeError("la velocidad debe ser mayor que 0")
+    return rate
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="zking_cli",
+        description="Descarga lotes de YouTube (MP4/MP3) sin interfaz gráfica.",
+    )
+    parser.add_argument("urls", help="archivo con una URL por línea ('-' para stdin)")
+    parser.add_argument("-o", "--output", default=os.path.join(os.getcwd(), "downloads"),
+                        help="carpeta de destino (por defecto ./downloads)")
+    parser.add_argument("-f", "--formato", dest="policy", type=parse_format_policy, default="max",
+                        help="política de formato: max, h264 o altura máxima (p. ej. 720)")
+    parser.add_argument("-e", "--encoder", default=None,
+                        help="encoder de FFmpeg cuando hay que recodificar; 'auto' mide los "
+                             "disponibles y guarda el más rápido (por defecto el de config.json "
+                             "o libx264)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help=f"descargas simultáneas (por defecto {MAX_WORKERS_DEFAULT}; "
+                             "con --mp3, al menos una por núcleo)")
+    parser.add_argument("--transcode-jobs", type=int, default=None,
+                        help="conversiones de FFmpeg simultáneas (por defecto "
+                             f"{DownloadPipeline.DEFAULT_WORKERS['transcode']}; con --mp3, una por núcleo)")
+    parser.add_argument("--chunked", choices=("auto", "on", "off"), default="auto",
+                        help="recodificar por trozos en paralelo (auto: con libx264, 4+ núcleos "
+                             "y videos largos)")
+    parser.add_argument("--chunk-seconds", type=float, default=30,
+                        help="duración aproximada de cada trozo al recodificar en paralelo")
+    parser.add_argument("--mp3", action="store_true", help="solo audio MP3 (modo música)")
+    parser.add_argument("--limit-rate", type=parse_rate, default=None,
+                        help="velocidad máxima para todo el lote, p. ej. 4M (bytes/s)")
+    parser.add_argument("--connections", type=int, default=16,
+                        help="total de conexiones para fragmentos y rangos entre todas las descargas")
+    parser.add_argument("--metrics-dir", default=None,
+                        help="carpeta para jobs.jsonl y zking.prom (por defecto <salida>/.metrics)")
+    parser.add_argument("--staging", default=None,
+                        help="carpeta de temporales, p. ej. un tmpfs (o ZKING_STAGING_DIR)")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    prefer_h264, max_height = args.policy
+
+    try:
+        urls = read_urls(args.urls)
+    except OSError as err:
+        print(f"No se pudo leer la lista de URLs: {err}", file=sys.stderr)
+        return EXIT_USO
+    if not urls:
+        print("La lista de URLs está vacía.", file=sys.stderr)
+        return EXIT_USO
+    os.makedirs(args.output, exist_ok=True)
+    bandwidth = BandwidthManager(args.limit_rate, max_connections=args.connections)
+    progress = JsonProgress(bandwidth=bandwidth)
+
+    settings = load_settings()
+    encoder, preset = args.encoder, None
+    if encoder == "auto":
+        results = probe_encoders(on_result=lambda r: progress.emit("encoder_probe", **r))
+        encoder, preset = best_encoder(results)
+        settings.update(encoder=encoder, encoder_preset=preset, encoder_probe=results)
+        save_settings(settings)
+    elif encoder is None:
+        encoder = settings.get("encoder") or "libx264"
+        preset = settings.get("encoder_preset")
+    encoder_fps = encoder_speed(settings.get("encoder_probe"), encoder, preset)
+
+    metadata_cache = MetadataCache()
+    engine = DownloadEngine(args.output, encoder, encoder_preset=preset,
+                            on_update=progress.on_update, prefer_h264=prefer_h264, metadata_cache=metadata_cache,
+                            max_height=max_height, staging_dir=args.staging,
+                            bandwidth=bandwidth, encoder_fps=encoder_fps,
+                            chunked={"auto": None, "on": True, "off": False}[args.chunked],
+                            chunk_seconds=args.chunk_seconds,
+                            metrics=MetricsRecorder(args.metrics_dir) if args.metrics_dir else None)
+    if args.mp3:
+        # Modo música: pool de encoders de MP3 con descargas continuas
+        pipeline = DownloadPipeline.for_music(engine, args.transcode_jobs, args.jobs,
+                                              on_job_done=progress.on_job_done)
+    else:
+        workers = {"fetch": args.jobs or MAX_WORKERS_DEFAULT,
+                   "transcode": args.transcode_jobs or DownloadPipeline.DEFAULT_WORKERS["transcode"]}
+        pipeline = DownloadPipeline(engine, workers, on_job_done=progress.on_job_done)
+    jobs = [DownloadJob(idx, limpiar_url_video(url), only_mp3=args.mp3)
+            for idx, url in enumerate(urls, 1)]
+
+    inicio = time.time()
+    try:
+        pipeline.run(jobs)
+    finally:
+        metadata_cache.flush()
+    resumen = pipeline.progress()
+    progress.emit("done", total=resumen["total"], ok=resumen["done"], failed=resumen["failed"],
+                  skipped=resumen["skipped"], per_minute=resumen["per_minute"],
+                  seconds=round(time.time() - inicio, 2), stages=resumen["stages"],
+                  metadata_cache=metadata_cache.stats())
+    return EXIT_FALLOS if resumen["failed"] else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2181 @@
+"""Motor de descargas de ZkingDownload (sin dependencias de la interfaz gráfica)."""
+
+from __future__ import annotations
+
+import glob
+import hashlib
+import http.client
+import itertools
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import sqlite3
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+import zipfile
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlsplit
+
+log = logging.getLogger("zking")
+
+MAX_WORKERS_DEFAULT = 3
+FFMPEG_FOLDER = "ffmpeg_bin"
+METADATA_CACHE_FILE = "metadata_cache.json"
+JOURNAL_FOLDER = ".journal"  # dentro de la carpeta de descargas
+HISTORY_DB = "historial.db"
+DOWNLOAD_ARCHIVE_FILE = ".archivo_descargas.txt"  # dentro de la carpeta de descargas
+SETTINGS_FILE = "config.json"
+METRICS_FOLDER = ".metrics"  # dentro de la carpeta de descargas
+
+# Encoders H.264 a probar y los presets de cada uno (del más rápido al más lento)
+ENCODER_PRESETS = {
+    "h264_nvenc": ("p1", "p4"),
+    "h264_qsv": ("veryfast", "medium"),
+    "h264_amf": ("speed", "balanced"),
+    "h264_videotoolbox": (None,),
+    "libx264": ("veryfast", "fast"),
+}
+
+# Coste de formatos (format_cost): fps aproximados a 1280x720 si no hay medición
+ENCODER_FPS_DEFAULT = {
+    "h264_nvenc": 400,
+    "h264_qsv": 300,
+    "h264_amf": 300,
+    "h264_videotoolbox": 250,
+    "libx264": 90,
+}
+DECODE_COST = {"av01": 1.6, "vp9": 1.2, "vp09": 1.2}  # decodificar el origen, relativo a H.264
+ASSUMED_BANDWIDTH = 4 * 1024 * 1024  # bytes/s si no hay límite de velocidad
+REMUX_BYTES_PER_SECOND = 200 * 1024 * 1024  # copiar sin recodificar: solo E/S
+
+# ===================== helpers ===================== #
+
+def extraer_video_id(url: str) -> str | None:
+    """Devuelve el ID de video (11 caracteres) de una URL de YouTube, o None."""
+    # Busca el ID de video (11 caracteres) en diferentes formatos de URL
+    patrones = [
+        r"(?:v=|\/)([A-Za-z0-9_-]{11})",  # v=ID o /ID
+    ]
+    for pat in patrones:
+        m = re.search(pat, url)
+        if m:
+            return m.group(1)
+    return None
+
+
+def limpiar_url_video(url):
+    """
+    Extrae el ID de video de cualquier URL de YouTube y devuelve la URL limpia.
+    Compatible con videos normales, shorts y YouTube Music.
+    """
+    video_id = extraer_video_id(url)
+    if video_id:
+        return f"https://www.youtube.com/watch?v={video_id}"
+    return url  # Si no encuentra, regresa la original
+
+
+def ffmpeg_executable() -> str:
+    """Ruta del ejecutable de FFmpeg: el de ffmpeg_bin si existe, si no el del PATH."""
+    local_ffmpeg = os.path.join(os.getcwd(), FFMPEG_FOLDER, "ffmpeg.exe")
+    if os.path.isfile(local_ffmpeg):
+        return local_ffmpeg
+    return shutil.which("ffmpeg") or local_ffmpeg
+
+
+def safe_filename(title: str) -> str:
+    """Quita del título los caracteres no válidos para un nombre de archivo."""
+    return "".join(c for c in title if c.isalnum() or c in " -_")
+
+
+def is_h264(vcodec: str | None) -> bool:
+    """True si el códec de video puede copiarse tal cual a un MP4 H.264."""
+    return bool(vcodec) and vcodec.split(".")[0].lower() in ("avc1", "avc3", "h264")
+
+
+def format_cost(f: dict, duration: float | None = None, encoder: str = "libx264",
+                encoder_fps: float | None = None, bandwidth: float | None = None) -> dict:
+    """
+    Coste esperado, en segundos, de descargar un formato video-only y dejarlo en
+    H.264: los bytes a la velocidad `bandwidth` más la CPU de remuxearlo (si ya es
+    H.264) o de recodificarlo con `encoder` (a `encoder_fps` fotogramas por
+    segundo a 1280x720, medidos con probe_encoders, o ENCODER_FPS_DEFAULT).
+    """
+    vcodec = f.get("vcodec") or ""
+    height = f.get("height") or 0
+    width = f.get("width") or height * 16 // 9
+    fps = f.get("fps") or 30
+    kbps = f.get("vbr") or f.get("tbr")
+    size = f.get("filesize") or f.get("filesize_approx")
+    if not duration and size and kbps:
+        duration = size / (kbps * 125)
+    estimado = not size
+    if not size:
+        # Sin tamaño: del bitrate o, si tampoco hay, ~0.1 bits por píxel. Sin duración
+        # (directos, estrenos) no hay con qué estimarlo y queda en 0.
+        duration = duration or 0
+        size = kbps * 125 * duration if kbps else width * height * fps * duration * 0.1 / 8
+
+    remux = is_h264(vcodec)
+    if remux:
+        cpu_s = size / REMUX_BYTES_PER_SECOND
+    else:
+        velocidad = encoder_fps or ENCODER_FPS_DEFAULT.get(encoder, ENCODER_FPS_DEFAULT["libx264"])
+        pixeles = width * height / (1280 * 720) if height else 1.0
+        decodificar = DECODE_COST.get(vcodec.split(".")[0].lower(), 1.0)
+        cpu_s = (duration or 0) * fps * pixeles * decodificar / velocidad
+    download_s = size / (bandwidth or ASSUMED_BANDWIDTH)
+    return {
+        "format_id": f.get("format_id"),
+        "resolution": f.get("resolution") or (height and f"{height}p") or "?p",
+        "height": height,
+        "ext": f.get("ext"),
+        "vcodec": vcodec,
+        "bytes": int(size),
+        "bytes_estimated": estimado,
+        "remux": remux,
+        "download_s": round(download_s, 2),
+        "cpu_s": round(cpu_s, 2),
+        "cost_s": round(download_s + cpu_s, 2),
+    }
+
+
+def rank_video_formats(info: dict, encoder: str = "libx264", encoder_fps: float | None = None,
+                       max_height: int | None = None, prefer_h264: bool = False,
+                       bandwidth: float | None = None) -> list[dict]:
+    """
+    Todos los formatos video-only (WebM/MP4) con su format_cost(), del mejor al peor.
+
+    Primero los que no superan max_height, de mayor a menor resolución (con
+    prefer_h264, antes los que se remuxean aunque tengan menos resolución); si
+    ninguno cabe, el más pequeño. A igual resolución decide el coste
+    y, si empatan (p. ej. sin duración ni tamaño), el que no hay que recodificar.
+    """
+    duration = info.get("duration")
+    costes = [
+        format_cost(f, duration, encoder, encoder_fps, bandwidth)
+        for f in info.get("formats", [])
+        if f.get("acodec") == "none" and f.get("vcodec") != "none" and f.get("ext") in ("webm", "mp4")
+    ]
+
+    def clave(c: dict) -> tuple:
+        fuera = bool(max_height) and c["height"] > max_height
+        return (fuera, prefer_h264 and not c["remux"], c["height"] if fuera else -c["height"],
+                c["cost_s"], not c["remux"])  # sin datos para estimar, mejor no recodificar
+
+    costes.sort(key=clave)
+    return costes
+
+
+def explain_format_choice(ranked: list[dict], max_height: int | None = None) -> str:
+    """Texto corto con el formato elegido (el primero de `ranked`) y por qué."""
+    if not ranked:
+        return "No hay formatos de video-only."
+
+    def resumen(c: dict) -> str:
+        accion = "remux" if c["remux"] else "recodificar"
+        tamano = ("~" if c["bytes_estimated"] else "") + f"{c['bytes'] / (1024 * 1024):.1f} MB"
+        return (f"{c['resolution']} {c['vcodec'].split('.')[0] or '?'} (itag {c['format_id']}): "
+                f"{accion}, {tamano}, {c['download_s']:.0f} s de descarga + {c['cpu_s']:.0f} s de CPU")
+
+    elegido = ranked[0]
+    texto = resumen(elegido)
+    if max_height and elegido["height"] > max_height:
+        texto += f" (nada cabe en {max_height}p: el más pequeño)"
+    # Las alternativas de la misma resolución muestran qué se ahorró
+    otros = [c for c in ranked[1:] if c["height"] == elegido["height"]][:2]
+    if otros:
+        texto += ". Descartados: " + "; ".join(resumen(c) for c in otros)
+    return texto
+
+
+def select_video_format(info: dict, **kwargs) -> tuple[dict | None, str]:
+    """El mejor formato según rank_video_formats() (mismos argumentos) y su explicación."""
+    ranked = rank_video_formats(info, **kwargs)
+    return (ranked[0] if ranked else None), explain_format_choice(ranked, kwargs.get("max_height"))
+
+
+def video_only_formats(info: dict, prefer_h264: bool = False, encoder: str = "libx264",
+                       encoder_fps: float | None = None) -> list[tuple[str, str]]:
+    """
+    Devuelve (descripcion, itag) de los formatos video-only, uno por resolución y
+    de menor a mayor. En cada resolución se queda el más barato según
+    rank_video_formats() (con prefer_h264, el H.264 aunque cueste más).
+    """
+    by_resolution: dict[str, dict] = {}
+    for c in rank_video_formats(info, encoder, encoder_fps, prefer_h264=prefer_h264):
+        by_resolution.setdefault(c["resolution"], c)
+
+    formats = []
+    for c in sorted(by_resolution.values(), key=lambda c: c["height"]):
+        size_mb = round(c["bytes"] / (1024 * 1024), 2)
+        desc = f"{c['resolution']} — {(c['ext'] or '?').upper()} — {size_mb}MB (itag:{c['format_id']})"
+        formats.append((desc, c["format_id"]))
+    return formats
+
+
+def video_encode_args(encoder: str, preset: str | None = None) -> list[str]:
+    """Argumentos de FFmpeg para recodificar el video a H.264 con el encoder dado."""
+    args = ["-c:v", encoder]
+    if encoder in ("libx264", "h264_nvenc"):
+        args += ["-preset", preset or "fast", "-crf", "22"]
+    elif encoder == "h264_qsv" and preset:
+        args += ["-preset", preset]
+    elif encoder == "h264_amf" and preset:
+        args += ["-quality", preset]
+    return args
+
+
+def available_encoders(ffmpeg_path: str | None = None) -> set[str]:
+    """Nombres de los encoders de video que trae este FFmpeg (`ffmpeg -encoders`)."""
+    try:
+        proc = subprocess.run([ffmpeg_path or ffmpeg_executable(), "-hide_banner", "-encoders"],
+                              capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return set()
+    encoders = set()
+    for line in proc.stdout.splitlines():
+        parts = line.split()
+        # " V....D libx264   libx264 H.264 / AVC ..."
+        if len(parts) >= 2 and len(parts[0]) == 6 and parts[0].startswith("V"):
+            encoders.add(parts[1])
+    return encoders
+
+
+def probe_encoders(ffmpeg_path: str | None = None, seconds: float = 2.0,
+                   size: str = "1280x720", on_result=None) -> list[dict]:
+    """
+    Cronometra una codificación sintética (testsrc2 de lavfi a /dev/null) con cada
+    encoder H.264 disponible y cada preset. Que un encoder aparezca en -encoders
+    no garantiza que funcione (falta la GPU o el driver): esos salen con ok=False.
+    """
+    ffmpeg_path = ffmpeg_path or ffmpeg_executable()
+    disponibles = available_encoders(ffmpeg_path)
+    results = []
+    for encoder, presets in ENCODER_PRESETS.items():
+        if encoder not in disponibles:
+            continue
+        for preset in presets:
+            cmd = [ffmpeg_path, "-hide_banner", "-v", "error", "-f", "lavfi",
+                   "-i", f"testsrc2=size={size}:rate=30", "-t", str(seconds),
+                   "-pix_fmt", "yuv420p", *video_encode_args(encoder, preset), "-f", "null", "-"]
+            inicio = time.perf_counter()
+            try:
+                ok = subprocess.run(cmd, capture_output=True, timeout=60).returncode == 0
+            except (OSError, subprocess.TimeoutExpired):
+                ok = False
+            transcurrido = time.perf_counter() - inicio
+            result = {
+                "encoder": encoder,
+                "preset": preset,
+                "ok": ok,
+                "seconds": round(transcurrido, 3),
+                "fps": round(seconds * 30 / transcurrido, 1) if ok else 0.0,
+            }
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return results
+
+
+def best_encoder(results: list[dict]) -> tuple[str, str | None]:
+    """El encoder/preset que funcionó más rápido; libx264 si no funcionó ninguno."""
+    ok = [r for r in results if r["ok"]]
+    if not ok:
+        return "libx264", "fast"
+    mejor = min(ok, key=lambda r: r["seconds"])
+    return mejor["encoder"], mejor["preset"]
+
+
+def encoder_speed(results: list[dict] | None, encoder: str, preset: str | None = None) -> float | None:
+    """fps medidos por probe_encoders para ese encoder/preset (None si no se midió)."""
+    for r in results or []:
+        if r.get("ok") and r.get("encoder") == encoder and r.get("preset") == preset:
+            return r.get("fps")
+    return None
+
+
+def load_settings(path: str = SETTINGS_FILE, legacy_txt: str | None = None) -> dict:
+    """
+    Configuración en JSON. La primera vez importa el antiguo config.txt, que
+    guardaba en el mismo archivo la carpeta de descargas o el encoder (el último
+    que se hubiera elegido pisaba al otro).
+    """
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+    settings: dict = {}
+    if legacy_txt and os.path.exists(legacy_txt):
+        with open(legacy_txt, "r", encoding="utf-8") as f:
+            valor = f.read().strip()
+        if valor in ENCODER_PRESETS:
+            settings["encoder"] = valor
+        elif os.path.isdir(valor):
+            settings["download_folder"] = valor
+        save_settings(settings, path)
+        os.replace(legacy_txt, f"{legacy_txt}.migrado")
+    return settings
+
+
+def save_settings(settings: dict, path: str = SETTINGS_FILE) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(settings, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def mux_command(ffmpeg_path: str, video_file: str, audio_file: str, output: str,
+                video_args: list[str]) -> list[str]:
+    """
+    Una sola pasada de FFmpeg: toma el video y el audio descargados y escribe el
+    MP4 final, con el audio codificado a AAC una única vez.
+    """
+    return [
+        ffmpeg_path, "-y",
+        "-i", video_file,
+        "-i", audio_file,
+        "-map", "0:v:0",
+        "-map", "1:a:0",
+        *video_args,
+        "-c:a", "aac",
+        "-b:a", "320k",
+        output,
+    ]
+
+
+def media_duration(ffmpeg_path: str, path: str) -> float | None:
+    """Duración en segundos leída de la cabecera que imprime `ffmpeg -i` (sin ffprobe)."""
+    try:
+        proc = subprocess.run([ffmpeg_path, "-hide_banner", "-i", path],
+                              capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    m = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", proc.stderr)
+    if not m:
+        return None
+    return int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3))
+
+
+def _ffmpeg_number(value: str | None) -> float:
+    """Valor numérico de una línea de -progress ('N/A' y vacíos cuentan como 0)."""
+    try:
+        return float((value or "").rstrip("x"))
+    except ValueError:
+        return 0.0
+
+
+def progress_info(out_time: float, fps: float, speed: float, duration: float | None) -> dict:
+    """Porcentaje y tiempo restante a partir de lo codificado y la duración total."""
+    return {
+        "out_time": round(out_time, 2),
+        "fps": round(fps, 1),
+        "speed": round(speed, 2),
+        "percent": round(min(100.0, out_time / duration * 100), 1) if duration else 0.0,
+        "eta": round(max(0.0, duration - out_time) / speed, 1) if duration and speed else None,
+    }
+
+
+class FFmpegError(subprocess.CalledProcessError):
+    """CalledProcessError cuyo texto incluye el final de la salida de error de FFmpeg."""
+
+    def __str__(self) -> str:
+        lineas = [l.strip() for l in (self.stderr or "").splitlines() if l.strip()]
+        detalle = "\n".join(lineas[-5:])
+        return f"FFmpeg terminó con código {self.returncode}" + (f":\n{detalle}" if detalle else "")
+
+
+def run_ffmpeg(cmd: list[str], duration: float | None = None, on_progress=None) -> None:
+    """
+    Ejecuta FFmpeg con `-progress pipe:1` y va leyendo los bloques clave=valor
+    que escribe: cada bloque se resume en out_time, fps, speed, porcentaje y ETA
+    y se pasa a `on_progress`. Si FFmpeg falla, lanza FFmpegError, cuyo mensaje
+    lleva las últimas líneas de su salida de error.
+    """
+    cmd = [cmd[0], "-hide_banner", "-progress", "pipe:1", "-nostats", *cmd[1:]]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            text=True, encoding="utf-8", errors="replace")
+    errores: deque = deque(maxlen=20)
+    # stderr se vacía en otro hilo para que FFmpeg no se bloquee con la tubería llena
+    lector = threading.Thread(target=errores.extend, args=(proc.stderr,), daemon=True)
+    lector.start()
+    bloque: dict[str, str] = {}
+    inicio = time.monotonic()
+    for line in proc.stdout:
+        key, _, value = line.strip().partition("=")
+        if key != "progress":
+            bloque[key] = value
+            continue
+        if on_progress:
+            # out_time_ms también viene en microsegundos (error histórico de FFmpeg)
+            out_time = _ffmpeg_number(bloque.get("out_time_us") or bloque.get("out_time_ms")) / 1e6
+            fps = _ffmpeg_number(bloque.get("fps"))
+            if not fps:
+                # En pasadas cortas FFmpeg informa fps=0: se calcula con los frames
+                fps = _ffmpeg_number(bloque.get("frame")) / max(time.monotonic() - inicio, 1e-3)
+            on_progress(progress_info(out_time, fps, _ffmpeg_number(bloque.get("speed")), duration))
+        bloque = {}
+    proc.wait()
+    lector.join()
+    if proc.returncode != 0:
+        raise FFmpegError(proc.returncode, cmd, stderr="".join(errores))
+
+
+def chunked_encode(ffmpeg_path: str, video_file: str, audio_file: str, output: str,
+                   video_args: list[str], workdir: str, segment_seconds: float = 30,
+                   workers: int | None = None, duration: float | None = None,
+                   on_progress=None) -> int:
+    """
+    Recodifica el video en paralelo: lo corta en keyframes (segment muxer con
+    -c copy), codifica cada trozo en su propio proceso de FFmpeg y une los trozos
+    con el demuxer concat sin recodificar, añadiendo el audio en esa misma pasada.
+    Devuelve el número de trozos. El avance que llega a `on_progress` suma el de
+    todos los trozos en curso.
+    """
+    # Trozos de un intento anterior (quizá con otra duración) estropearían el concat
+    shutil.rmtree(workdir, ignore_errors=True)
+    os.makedirs(workdir)
+    run_ffmpeg([
+        ffmpeg_path, "-y", "-v", "error", "-i", video_file, "-map", "0:v:0", "-c", "copy",
+        "-f", "segment", "-segment_time", str(segment_seconds), "-reset_timestamps", "1",
+        os.path.join(workdir, "src_%04d.mkv"),
+    ])
+    trozos = sorted(f for f in os.listdir(workdir) if f.startswith("src_"))
+
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(workers or cpus, len(trozos)))
+    # Reparte los hilos de cada encoder para no sobrecargar la máquina
+    hilos = ["-threads", str(max(1, cpus // workers))]
+
+    lock = threading.Lock()
+    en_curso: dict[str, dict] = {}
+    terminado = 0.0  # segundos de video de los trozos ya codificados
+
+    def parcial(nombre: str, info: dict) -> None:
+        with lock:
+            en_curso[nombre] = info
+            out_time = terminado + sum(p["out_time"] for p in en_curso.values())
+            fps = sum(p["fps"] for p in en_curso.values())
+            speed = sum(p["speed"] for p in en_curso.values())
+        on_progress(progress_info(out_time, fps, speed, duration))
+
+    def encode(nombre: str) -> str:
+        nonlocal terminado
+        destino = os.path.join(workdir, nombre.replace("src_", "enc_").replace(".mkv", ".mp4"))
+        run_ffmpeg([ffmpeg_path, "-y", "-v", "error", "-i", os.path.join(workdir, nombre),
+                    "-an", *video_args, *hilos, destino],
+                   on_progress=(lambda info: parcial(nombre, info)) if on_progress else None)
+        with lock:
+            terminado += en_curso.pop(nombre, {}).get("out_time", 0.0)
+        return destino
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="trozo") as pool:
+        codificados = list(pool.map(encode, trozos))
+
+    lista = os.path.join(workdir, "concat.txt")
+    with open(lista, "w", encoding="utf-8") as f:
+        for path in codificados:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+    run_ffmpeg([
+        ffmpeg_path, "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", lista,
+        "-i", audio_file, "-map", "0:v:0", "-map", "1:a:0",
+        "-c:v", "copy", "-c:a", "aac", "-b:a", "320k", output,
+    ])
+    return len(codificados)
+
+# ===================== caché de metadatos ===================== #
+
+class MetadataCache:
+    """
+    Caché en disco de título, miniatura y formatos video-only por ID de video.
+
+    Las entradas caducan tras `ttl` segundos y, si se supera `max_entries`, se
+    expulsan las usadas hace más tiempo (LRU). Lleva contadores de aciertos y fallos.
+    El archivo se reescribe cada `save_every` entradas nuevas y en flush(), que
+    hay que llamar al terminar el lote o al cerrar la aplicación.
+    """
+
+    # Campos de cada formato que necesita video_only_formats()
+    FORMAT_FIELDS = ("format_id", "ext", "acodec", "vcodec", "resolution", "height", "width",
+                     "filesize", "filesize_approx", "tbr", "vbr", "fps")
+
+    def __init__(self, path: str = METADATA_CACHE_FILE, ttl: float = 6 * 3600,
+                 max_entries: int = 500, save_every: int = 20) -> None:
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.save_every = max(1, save_every)
+        self._unsaved = 0  # entradas nuevas que aún no están en el archivo
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        # Se guardan de menos a más reciente: el orden del archivo es el orden LRU
+        for video_id, entry in data.get("entries", {}).items():
+            self._entries[video_id] = entry
+
+    def _save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"entries": self._entries}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            return  # la caché es opcional: si no se puede escribir, se sigue sin ella
+        self._unsaved = 0
+
+    def flush(self) -> None:
+        """Escribe en disco las entradas nuevas que queden pendientes."""
+        with self._lock:
+            if self._unsaved:
+                self._save()
+
+    def get(self, video_id: str | None) -> dict | None:
+        """Entrada vigente ({title, thumbnail, duration, formats}) o None si no está o caducó."""
+        with self._lock:
+            entry = self._entries.get(video_id) if video_id else None
+            if entry is None or time.time() - entry["saved"] > self.ttl:
+                if entry is not None:
+                    del self._entries[video_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(video_id)
+            self.hits += 1
+            return entry
+
+    def put(self, video_id: str | None, info: dict) -> None:
+        """Guarda lo necesario de un info dict de yt-dlp (solo formatos video-only)."""
+        if not video_id:
+            return
+        formats = [
+            {k: f.get(k) for k in self.FORMAT_FIELDS if f.get(k) is not None}
+            for f in info.get("formats", [])
+            if f.get("acodec") == "none" and f.get("vcodec") != "none"
+        ]
+        entry = {
+            "saved": time.time(),
+            "title": info.get("title", "video"),
+            "thumbnail": info.get("thumbnail"),
+            "duration": info.get("duration"),
+            "formats": formats,
+        }
+        with self._lock:
+            self._entries[video_id] = entry
+            self._entries.move_to_end(video_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._unsaved += 1
+            if self._unsaved >= self.save_every:
+                self._save()
+
+    def stats(self) -> dict:
+        """Entradas, aciertos, fallos y expulsiones desde que se abrió la caché."""
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+# ===================== diario de trabajos ===================== #
+
+class JobJournal:
+    """
+    Diario en disco de las fases ya terminadas de un trabajo.
+
+    Si la aplicación se cierra a mitad de un lote, al volver a lanzarlo cada
+    trabajo retoma desde su última fase completada: los flujos ya bajados no se
+    piden de nuevo, los .part se continúan con yt-dlp y los trabajos terminados
+    se saltan.
+    """
+
+    AUDIO = "audio"
+    VIDEO = "video"
+    TRANSCODE = "transcode"
+    DONE = "done"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self.phases: dict[str, dict] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.phases = json.load(f).get("phases", {})
+            except (OSError, json.JSONDecodeError):
+                self.phases = {}  # diario corrupto: se rehace el trabajo entero
+
+    @staticmethod
+    def key_for(job: "DownloadJob") -> str:
+        """Clave estable entre ejecuciones: ID de video + perfil de salida."""
+        video_id = extraer_video_id(job.url) or safe_filename(job.url)[-40:]
+        perfil = "mp3" if job.only_mp3 else f"v{job.itag}"
+        return f"{video_id}_{perfil}"
+
+    def done(self, phase: str, *files: str) -> bool:
+        """True si la fase se completó y sus archivos siguen en disco."""
+        with self._lock:
+            entry = self.phases.get(phase)
+        if entry is None:
+            return False
+        return all(f and os.path.exists(f) for f in files)
+
+    def get(self, phase: str) -> dict:
+        with self._lock:
+            return dict(self.phases.get(phase, {}))
+
+    def mark(self, phase: str, **data) -> None:
+        with self._lock:
+            self.phases[phase] = {"time": time.time(), **data}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"phases": self.phases}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+# ===================== historial ===================== #
+
+class DownloadHistory:
+    """
+    Historial de descargas en SQLite.
+
+    Cada descarga es un INSERT (no se reescribe nada) y las consultas van por
+    páginas con índices por fecha, ID de video y formato. La primera vez importa
+    el antiguo historial.json y lo renombra a .migrado.
+    """
+
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path: str = HISTORY_DB, legacy_json: str | None = None) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS descargas (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    fecha TEXT NOT NULL,
+                    titulo TEXT NOT NULL,
+                    formato TEXT NOT NULL,
+                    video_id TEXT,
+                    url TEXT,
+                    salida TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_descargas_fecha ON descargas (fecha);
+                CREATE INDEX IF NOT EXISTS idx_descargas_video ON descargas (video_id);
+                CREATE INDEX IF NOT EXISTS idx_descargas_formato ON descargas (formato);
+            """)
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < self.SCHEMA_VERSION:
+                if legacy_json:
+                    self._migrate_json(legacy_json)
+                self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def _migrate_json(self, legacy_json: str) -> None:
+        if not os.path.exists(legacy_json):
+            return
+        try:
+            with open(legacy_json, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        # El JSON guardaba lo más reciente primero; se inserta en orden cronológico
+        self._conn.executemany(
+            "INSERT INTO descargas (fecha, titulo, formato) VALUES (?, ?, ?)",
+            [(d.get("fecha", ""), d.get("titulo", ""), d.get("formato", ""))
+             for d in reversed(datos) if isinstance(d, dict)],
+        )
+        os.replace(legacy_json, f"{legacy_json}.migrado")
+
+    def add(self, title: str, formato: str, video_id: str | None = None,
+            url: str | None = None, output: str | None = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO descargas (fecha, titulo, formato, video_id, url, salida) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (time.strftime("%Y-%m-%d %H:%M"), title, formato, video_id, url, output),
+            )
+
+    @staticmethod
+    def _where(video_id: str | None, formato: str | None) -> tuple[str, list]:
+        conds, params = [], []
+        if video_id:
+            conds.append("video_id = ?")
+            params.append(video_id)
+        if formato:
+            conds.append("formato = ?")
+            params.append(formato)
+        return (" WHERE " + " AND ".join(conds)) if conds else "", params
+
+    def page(self, offset: int = 0, limit: int = 50, video_id: str | None = None,
+             formato: str | None = None) -> list[dict]:
+        """Descargas de la más reciente a la más antigua, `limit` a partir de `offset`."""
+        where, params = self._where(video_id, formato)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT fecha, titulo, formato, video_id, url, salida FROM descargas{where} "
+                "ORDER BY fecha DESC, id DESC LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def count(self, video_id: str | None = None, formato: str | None = None) -> int:
+        where, params = self._where(video_id, formato)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM descargas{where}", params).fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+# ===================== archivo de descargas ===================== #
+
+class DownloadArchive:
+    """
+    Índice de lo ya descargado, como el --download-archive de yt-dlp: una línea
+    "video_id_perfil<TAB>ruta" por descarga. Se carga entero en un dict al abrir
+    (consulta O(1), sin red) y cada descarga nueva se añade al final del archivo.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries: dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    key, _, output = line.rstrip("\n").partition("\t")
+                    if key and output:
+                        self.entries[key] = output
+
+    def lookup(self, key: str) -> str | None:
+        """Ruta del archivo ya descargado, si sigue en disco."""
+        with self._lock:
+            output = self.entries.get(key)
+        return output if output and os.path.exists(output) else None
+
+    def add(self, key: str, output: str) -> None:
+        with self._lock:
+            self.entries[key] = output
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(f"{key}\t{output}\n")
+
+# ===================== espacio en disco ===================== #
+
+def estimate_job_bytes(info: dict | None, itag: str | None, only_mp3: bool) -> int:
+    """Bytes a descargar según filesize/filesize_approx (o tbr x duración) del info dict."""
+    if not info:
+        return 0
+    duration = info.get("duration") or 0
+
+    def size(f: dict) -> int:
+        return int(f.get("filesize") or f.get("filesize_approx")
+                   or (f.get("tbr") or 0) * 1000 / 8 * duration)
+
+    formats = info.get("formats", [])
+    audio = max((size(f) for f in formats
+                 if f.get("vcodec") == "none" and f.get("acodec") not in (None, "none")), default=0)
+    if only_mp3:
+        return audio
+    video = next((size(f) for f in formats if f.get("format_id") == itag), 0)
+    return audio + video
+
+
+class DiskBudget:
+    """
+    Reparte el espacio libre entre los trabajos en curso.
+
+    Antes de descargar, cada trabajo reserva lo que estima ocupar en cada carpeta
+    (staging y destino; si están en el mismo disco se suman). Si no cabe, espera a
+    que otros trabajos liberen su reserva; si no hay nada que esperar, falla.
+    """
+
+    def __init__(self, margin_bytes: int = 200 * 1024 * 1024) -> None:
+        self.margin_bytes = margin_bytes
+        self._reserved: dict[int, int] = {}  # st_dev -> bytes reservados
+        self._by_key: dict[str, dict[int, int]] = {}
+        self._cond = threading.Condition()
+
+    def reserve(self, key: str, needs: dict[str, int], on_wait=None) -> None:
+        per_dev: dict[int, int] = {}
+        paths: dict[int, str] = {}
+        for path, nbytes in needs.items():
+            os.makedirs(path, exist_ok=True)
+            dev = os.stat(path).st_dev
+            per_dev[dev] = per_dev.get(dev, 0) + nbytes
+            paths[dev] = path
+
+        with self._cond:
+            while True:
+                faltan = [
+                    dev for dev, nbytes in per_dev.items()
+                    if shutil.disk_usage(paths[dev]).free - self._reserved.get(dev, 0)
+                    - self.margin_bytes < nbytes
+                ]
+                if not faltan:
+                    break
+                if not any(self._reserved.get(dev) for dev in faltan):
+                    dev = faltan[0]
+                    raise OSError(
+                        f"Espacio insuficiente en {paths[dev]}: se necesitan "
+                        f"{per_dev[dev] / (1024 * 1024):.0f} MB"
+                    )
+                if on_wait:
+                    on_wait()
+                self._cond.wait(timeout=5)
+            for dev, nbytes in per_dev.items():
+                self._reserved[dev] = self._reserved.get(dev, 0) + nbytes
+            self._by_key[key] = per_dev
+
+    def release(self, key: str) -> None:
+        with self._cond:
+            for dev, nbytes in self._by_key.pop(key, {}).items():
+                self._reserved[dev] = max(0, self._reserved.get(dev, 0) - nbytes)
+            self._cond.notify_all()
+
+# ===================== ancho de banda ===================== #
+
+class BandwidthManager:
+    """
+    Reparte un límite global de velocidad entre todos los flujos activos.
+
+    Los bytes que informa el progress hook de yt-dlp se descuentan de un cubo de
+    tokens compartido; si se agota, el hook duerme y la descarga se frena. Las
+    conexiones para fragmentos (DASH/HLS) y rangos salen de un presupuesto común
+    de `max_connections`: cada flujo toma su parte de lo que queda libre al
+    abrirse y la devuelve al cerrarse. yt-dlp no cambia las conexiones de una
+    descarga en marcha, así que no se reequilibran; si el presupuesto está
+    agotado, el flujo nuevo recibe una sola. La velocidad real conseguida se mide
+    por trabajo y en total.
+    """
+
+    def __init__(self, rate_limit: float | None = None, max_connections: int = 16,
+                 retries: int = 10, window: float = 3.0) -> None:
+        self.rate_limit = rate_limit  # bytes/s para todo el lote; None = sin límite
+        self.max_connections = max_connections
+        self.retries = retries
+        self.window = window
+        self._lock = threading.Lock()
+        self._tokens = float(rate_limit or 0)
+        self._last_refill = time.monotonic()
+        self._streams: dict = {}  # clave del flujo -> conexiones concedidas
+        self._samples: deque = deque()  # (instante, clave del trabajo, bytes)
+
+    def open_stream(self, key) -> dict:
+        """Registra un flujo y devuelve las opciones de yt-dlp que le tocan."""
+        with self._lock:
+            self._streams.pop(key, None)
+            libres = self.max_connections - sum(self._streams.values())
+            reparto = self.max_connections // (len(self._streams) + 1)
+            fragments = self._streams[key] = max(1, min(8, reparto, libres))
+        opts = {
+            "concurrent_fragment_downloads": fragments,
+            "retries": self.retries,
+            "fragment_retries": self.retries,
+        }
+        if self.rate_limit:
+            # Tope por flujo: también acota el bloque de lectura de yt-dlp, así el
+            # hook se llama a menudo y el reparto del cubo es fino.
+            opts["ratelimit"] = self.rate_limit
+        return opts
+
+    def close_stream(self, key) -> None:
+        with self._lock:
+            self._streams.pop(key, None)
+
+    def consume(self, job_key, nbytes: int) -> None:
+        """Anota `nbytes` recibidos y, si hay límite, espera lo que toque."""
+        if nbytes <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, job_key, nbytes))
+            while self._samples and now - self._samples[0][0] > self.window:
+                self._samples.popleft()
+            if not self.rate_limit:
+                return
+            self._tokens = min(self.rate_limit,
+                               self._tokens + (now - self._last_refill) * self.rate_limit)
+            self._last_refill = now
+            self._tokens -= nbytes
+            espera = -self._tokens / self.rate_limit if self._tokens < 0 else 0.0
+        if espera:
+            time.sleep(espera)
+
+    def throughput(self) -> dict:
+        """Velocidad conseguida (bytes/s) en la última ventana: total y por trabajo."""
+        now = time.monotonic()
+        por_trabajo: dict = {}
+        with self._lock:
+            for instante, job_key, nbytes in self._samples:
+                if now - instante <= self.window:
+                    por_trabajo[job_key] = por_trabajo.get(job_key, 0) + nbytes
+        jobs = {k: v / self.window for k, v in por_trabajo.items()}
+        return {"total": sum(jobs.values()), "jobs": jobs, "limit": self.rate_limit}
+
+# ===================== descarga segmentada ===================== #
+
+class RangeNotSupported(OSError):
+    """El servidor no acepta peticiones Range: hay que descargar con una sola conexión."""
+
+
+class SegmentedDownloader:
+    """
+    Descarga un archivo HTTP(S) por rangos de bytes sobre varias conexiones
+    keep-alive. Se escribe en `<path>.rangos.part`, reservado con su tamaño
+    final, y cada rango va a su posición; si un rango falla, solo ese rango se
+    reintenta, desde el último byte escrito. Los rangos terminados se anotan en
+    `<path>.rangos.json`, así que una descarga interrumpida se retoma bajando
+    solo los rangos que faltan. Al terminar, el .part pasa a `path`.
+    """
+
+    CHUNK = 64 * 1024
+
+    def __init__(self, url: str, path: str, total_bytes: int | None = None,
+                 headers: dict | None = None, connections: int = 4,
+                 segment_bytes: int | None = None, retries: int = 5,
+                 on_progress=None, timeout: float = 30) -> None:
+        self.url = url
+        self.path = path
+        self.part_path = path + ".rangos.part"
+        self.state_path = path + ".rangos.json"
+        self.total_bytes = total_bytes
+        self.headers = dict(headers or {})
+        self.connections = max(1, connections)
+        self.segment_bytes = segment_bytes
+        self.retries = retries
+        self.on_progress = on_progress  # recibe los bytes nuevos de cada bloque
+        self.timeout = timeout
+        self._segments: queue.Queue = queue.Queue()
+        self._errors: list[Exception] = []
+        self._failed = threading.Event()
+        self._state_lock = threading.Lock()
+        self._done: set[int] = set()  # inicio de cada rango ya escrito entero
+        self._segment = 0
+
+    def _connect(self, url: str) -> http.client.HTTPConnection:
+        parts = urlsplit(url)
+        cls = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        return cls(parts.netloc, timeout=self.timeout)
+
+    def _request(self, conn: http.client.HTTPConnection, start: int, end: int):
+        parts = urlsplit(self.url)
+        target = parts.path + (f"?{parts.query}" if parts.query else "")
+        conn.request("GET", target or "/", headers={**self.headers, "Range": f"bytes={start}-{end}"})
+        return conn.getresponse()
+
+    def _probe(self) -> None:
+        """Sigue redirecciones, comprueba que hay soporte de Range y fija el tamaño."""
+        for _ in range(5):
+            conn = self._connect(self.url)
+            try:
+                resp = self._request(conn, 0, 0)
+                if resp.status in (301, 302, 303, 307, 308) and resp.getheader("Location"):
+                    resp.read()
+                    self.url = urljoin(self.url, resp.getheader("Location"))
+                    continue
+                rango = resp.getheader("Content-Range") or ""
+                if resp.status != 206 or "/" not in rango:
+                    # Sin leer el cuerpo: con un 200 sería el archivo entero (se cierra la conexión)
+                    raise RangeNotSupported(f"Sin soporte de Range (HTTP {resp.status})")
+                resp.read()
+                total = rango.rsplit("/", 1)[1]
+                if total.isdigit():
+                    self.total_bytes = int(total)
+                if not self.total_bytes:
+                    raise RangeNotSupported("Tamaño desconocido")
+                return
+            finally:
+                conn.close()
+        raise RangeNotSupported("Demasiadas redirecciones")
+
+    def _load_state(self) -> None:
+        """Recupera los rangos ya escritos de un intento anterior con el mismo tamaño."""
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                estado = json.load(f)
+            if (estado.get("total") == self.total_bytes
+                    and os.path.getsize(self.part_path) == self.total_bytes):
+                self._segment = int(estado["segment"])
+                self._done = {int(s) for s in estado.get("done", [])}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            self._done = set()
+
+    def _save_state(self) -> None:
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"total": self.total_bytes, "segment": self._segment,
+                       "done": sorted(self._done)}, f)
+        os.replace(tmp, self.state_path)
+
+    def _fetch_range(self, conn: http.client.HTTPConnection, f, start: int,
+                     end: int) -> tuple[int, Exception | None]:
+        """
+        Escribe en `f` lo que llegue de [start, end]. Devuelve la siguiente
+        posición y, si la conexión falló antes del final, el error: lo ya escrito
+        vale y el reintento sigue desde esa posición.
+        """
+        pos = start
+        try:
+            resp = self._request(conn, start, end)
+            if resp.status != 206:
+                resp.read()
+                return pos, OSError(f"HTTP {resp.status} al pedir bytes={start}-{end}")
+            f.seek(start)
+            while pos <= end:
+                chunk = resp.read(min(self.CHUNK, end - pos + 1))
+                if not chunk:
+                    break
+                f.write(chunk)
+                pos += len(chunk)
+                if self.on_progress:
+                    self.on_progress(len(chunk))
+        except (OSError, http.client.HTTPException) as err:
+            return pos, err
+        if pos <= end:
+            return pos, OSError(f"Conexión cortada en el byte {pos}")
+        return pos, None
+
+    def _worker(self) -> None:
+        conn = None
+        with open(self.part_path, "r+b") as f:
+            while not self._failed.is_set():
+                try:
+                    inicio, end = self._segments.get_nowait()
+                except queue.Empty:
+                    break
+                start = inicio
+                intentos = 0
+                while start <= end and not self._failed.is_set():
+                    try:
+                        conn = conn or self._connect(self.url)
+                    except OSError as err:
+                        error = err
+                    else:
+                        antes = start
+                        start, error = self._fetch_range(conn, f, start, end)
+                        if start > antes:
+                            intentos = 0  # la conexión avanzaba: no es un fallo persistente
+                    if error is None:
+                        continue
+                    # Reintenta solo lo que falta de este rango, con una conexión nueva
+                    if conn is not None:
+                        conn.close()
+                        conn = None
+                    intentos += 1
+                    if intentos > self.retries:
+                        self._errors.append(error)
+                        self._failed.set()
+                        break
+                    time.sleep(min(0.5 * 2 ** intentos, 10))
+                if start > end:
+                    # El rango se anota después de pasar sus bytes al archivo
+                    f.flush()
+                    with self._state_lock:
+                        self._done.add(inicio)
+                        self._save_state()
+        if conn is not None:
+            conn.close()
+
+    def download(self) -> str:
+        self._probe()
+        total = self.total_bytes
+        self._load_state()
+        if not self._done:
+            # Rangos pequeños frente al total: las conexiones rápidas toman más rangos
+            self._segment = self.segment_bytes or max(1024 * 1024, total // (self.connections * 4))
+            with open(self.part_path, "wb") as f:
+                f.truncate(total)  # reserva el tamaño final; cada rango escribe en su sitio
+            self._save_state()
+        segment = self._segment
+        hecho = 0
+        for start in range(0, total, segment):
+            end = min(start + segment, total) - 1
+            if start in self._done:
+                hecho += end - start + 1
+            else:
+                self._segments.put((start, end))
+        if hecho and self.on_progress:
+            self.on_progress(hecho)  # lo retomado cuenta una sola vez
+
+        hilos = [threading.Thread(target=self._worker, name=f"rango-{n}", daemon=True)
+                 for n in range(min(self.connections, self._segments.qsize()))]
+        for t in hilos:
+            t.start()
+        for t in hilos:
+            t.join()
+        if self._errors:
+            raise self._errors[0]  # el .part y los rangos hechos quedan para retomar
+        os.replace(self.part_path, self.path)
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+        return self.path
+
+# ===================== instalación de FFmpeg ===================== #
+
+class FFmpegBootstrap:
+    """
+    Instala el ejecutable de FFmpeg en `install_dir` desde el ZIP "essentials"
+    de gyan.dev (Windows).
+
+    El ZIP se guarda en `cache_dir` con la versión en el nombre. Si la descarga
+    se corta, la siguiente vez se retoma con Range desde el .part, y un ZIP ya
+    completo cuyo SHA-256 coincide no se vuelve a bajar. Del ZIP solo se
+    descomprime el ejecutable. No toca la interfaz: el avance se informa con
+    on_progress(bytes_leidos, bytes_totales).
+    """
+
+    ARCHIVE_URL = "https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip"
+    VERSION_URL = "https://www.gyan.dev/ffmpeg/builds/release-version"
+    CHUNK = 256 * 1024
+    _lock = threading.Lock()  # una sola instalación a la vez en todo el proceso
+
+    def __init__(self, install_dir: str = FFMPEG_FOLDER, archive_url: str = ARCHIVE_URL,
+                 version_url: str | None = VERSION_URL, checksum_url: str | None = None,
+                 sha256: str | None = None, cache_dir: str | None = None,
+                 binary: str = "ffmpeg.exe", on_progress=None, retries: int = 5,
+                 timeout: float = 30) -> None:
+        self.install_dir = install_dir
+        self.archive_url = archive_url
+        self.version_url = version_url
+        self.checksum_url = checksum_url or archive_url + ".sha256"
+        self.sha256 = sha256
+        self.cache_dir = cache_dir or os.path.join(install_dir, "cache")
+        self.binary = binary
+        self.on_progress = on_progress
+        self.retries = retries
+        self.timeout = timeout
+
+    @property
+    def target(self) -> str:
+        return os.path.join(self.install_dir, self.binary)
+
+    def _get_text(self, url: str | None) -> str | None:
+        """Contenido (corto) de una URL de texto, o None si no se puede leer."""
+        if not url:
+            return None
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as resp:
+                return resp.read().decode("utf-8", "replace").strip() or None
+        except (OSError, ValueError, http.client.HTTPException):
+            return None
+
+    def archive_path(self, version: str | None) -> str:
+        nombre = re.sub(r"[^\w.-]", "", version or "") or "latest"
+        return os.path.join(self.cache_dir, f"ffmpeg-{nombre}-essentials.zip")
+
+    def download(self, path: str) -> str:
+        """Baja el ZIP a `path` retomando `path`.part si existe; reintenta los cortes."""
+        parcial = path + ".part"
+        intentos = 0
+        while True:
+            pos = os.path.getsize(parcial) if os.path.exists(parcial) else 0
+            request = urllib.request.Request(self.archive_url)
+            if pos:
+                request.add_header("Range", f"bytes={pos}-")
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+                    if resp.status == 206:
+                        total = int((resp.headers.get("Content-Range") or "/0").rsplit("/", 1)[1] or 0)
+                    else:
+                        pos = 0  # el servidor ignoró el Range: se empieza de cero
+                        total = int(resp.headers.get("Content-Length") or 0)
+                    with open(parcial, "ab" if pos else "wb") as f:
+                        while True:
+                            chunk = resp.read(self.CHUNK)
+                            if not chunk:
+                                break
+                            f.write(chunk)
+                            pos += len(chunk)
+                            if self.on_progress:
+                                self.on_progress(pos, total)
+                if total and pos < total:
+                    raise OSError(f"Conexión cortada en el byte {pos} de {total}")
+                break
+            except urllib.error.HTTPError as err:
+                if err.code == 416 and pos:
+                    break  # el .part ya estaba completo
+                if err.code < 500:
+                    raise
+                intentos += 1
+                if intentos > self.retries:
+                    raise
+            except OSError:
+                intentos += 1
+                if intentos > self.retries:
+                    raise
+            time.sleep(min(0.5 * 2 ** intentos, 10))
+        os.replace(parcial, path)
+        return path
+
+    @staticmethod
+    def file_sha256(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for bloque in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(bloque)
+        return digest.hexdigest()
+
+    def extract(self, archive: str) -> str:
+        """Descomprime solo el ejecutable (preferiblemente el de bin/) a install_dir."""
+        with zipfile.ZipFile(archive) as z:
+            miembros = [m for m in z.infolist()
+                        if not m.is_dir() and m.filename.rsplit("/", 1)[-1] == self.binary]
+            if not miembros:
+                raise FileNotFoundError(f"{self.binary} no encontrado en el ZIP.")
+            miembro = min(miembros, key=lambda m: "/bin/" not in "/" + m.filename)
+            tmp = self.target + ".tmp"
+            with z.open(miembro) as src, open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst, self.CHUNK)
+        if os.name != "nt":
+            os.chmod(tmp, 0o755)
+        os.replace(tmp, self.target)
+        return self.target
+
+    def install(self) -> str:
+        """Devuelve la ruta del ejecutable, descargándolo e instalándolo si falta."""
+        with self._lock:
+            if os.path.isfile(self.target):
+                return self.target
+            os.makedirs(self.cache_dir, exist_ok=True)
+            version = self._get_text(self.version_url)
+            cacheados = sorted(glob.glob(os.path.join(self.cache_dir, "ffmpeg-*-essentials.zip*")),
+                               key=os.path.getmtime)
+            if version or not cacheados:
+                archive = self.archive_path(version)
+            else:
+                # No se pudo leer la versión (fallo de red puntual): se sigue con el ZIP
+                # o el .part más reciente de la caché en vez de empezar de cero.
+                archive = cacheados[-1].removesuffix(".part")
+            esperado = self.sha256
+            if not esperado:
+                # "<hash>  <archivo>"; si no parece un SHA-256 no se verifica
+                partes = (self._get_text(self.checksum_url) or "").split()
+                if partes and re.fullmatch(r"[0-9a-fA-F]{64}", partes[0]):
+                    esperado = partes[0].lower()
+
+            if os.path.exists(archive) and esperado and self.file_sha256(archive) != esperado:
+                os.remove(archive)  # caché dañada o de otra compilación con el mismo nombre
+            if not os.path.exists(archive):
+                self.download(archive)
+                if esperado and self.file_sha256(archive) != esperado:
+                    os.remove(archive)
+                    raise ValueError("El SHA-256 del ZIP de FFmpeg no coincide; se descartó la descarga.")
+            # Solo se guarda el ZIP de la versión actual (si se sabe cuál es)
+            for viejo in cacheados if version else []:
+                if viejo not in (archive, archive + ".part") and os.path.exists(viejo):
+                    os.remove(viejo)
+            try:
+                return self.extract(archive)
+            except zipfile.BadZipFile:
+                os.remove(archive)  # sin checksum con qué comprobarlo: se baja de nuevo la próxima vez
+                raise
+
+# ===================== métricas ===================== #
+
+class MetricsRecorder:
+    """
+    Registro de cada trabajo terminado: una línea JSON por trabajo (jobs.jsonl,
+    con el tiempo de cada fase, bytes, velocidad media, encoder y resultado) y un
+    archivo de métricas en formato de texto de Prometheus (zking.prom) con
+    contadores e histogramas de latencia, reescrito tras cada trabajo para que
+    un textfile collector lo pueda leer.
+    """
+
+    BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self.log_path = os.path.join(folder, "jobs.jsonl")
+        self.prom_path = os.path.join(folder, "zking.prom")
+        self._lock = threading.Lock()
+        self.jobs_total: dict[str, int] = {}  # resultado -> trabajos
+        self.bytes_total = 0
+        self.phase_hist: dict[str, list] = {}  # fase -> [cuentas por bucket, suma, total]
+        self.job_hist = [[0] * len(self.BUCKETS), 0.0, 0]
+
+    def _observe(self, hist: list, value: float) -> None:
+        for i, limite in enumerate(self.BUCKETS):
+            if value <= limite:
+                hist[0][i] += 1
+        hist[1] += value
+        hist[2] += 1
+
+    def record(self, job: "DownloadJob", encoder: str | None = None, profile: str | None = None) -> None:
+        fetch_seconds = max((job.timings.get(s, 0.0) for s in ("audio", "video")), default=0.0)
+        entry = {
+            "time": round(time.time(), 3),
+            "index": job.index,
+            "url": job.url,
+            "video_id": extraer_video_id(job.url),
+            "title": job.title,
+            "outcome": job.status,
+            "error": str(job.error) if job.error else None,
+            "profile": profile,
+            "encoder": encoder if job.video_path in ("transcode", "chunked") else None,
+            "video_path": job.video_path or None,
+            "phases": {k: round(v, 3) for k, v in job.timings.items()},
+            "total_seconds": round(job.elapsed, 3),
+            "bytes": job.fetched_bytes,
+            "throughput": round(job.fetched_bytes / fetch_seconds) if fetch_seconds else None,
+            "encode": job.encode_stats or None,
+            "resumed": job.resumed,
+            "output": job.output_file,
+        }
+        with self._lock:
+            self.jobs_total[job.status] = self.jobs_total.get(job.status, 0) + 1
+            self.bytes_total += job.fetched_bytes
+            for phase, seconds in job.timings.items():
+                hist = self.phase_hist.setdefault(phase, [[0] * len(self.BUCKETS), 0.0, 0])
+                self._observe(hist, seconds)
+            if job.status != DownloadJob.SALTADO:
+                self._observe(self.job_hist, job.elapsed)
+            os.makedirs(self.folder, exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._write_prom()
+
+    def _hist_lines(self, name: str, hist: list, labels: str = "") -> list[str]:
+        sep = "," if labels else ""
+        lines = [f'{name}_bucket{{{labels}{sep}le="{limite}"}} {n}'
+                 for limite, n in zip(self.BUCKETS, hist[0])]
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {hist[2]}')
+        etiqueta = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{etiqueta} {hist[1]:.3f}")
+        lines.append(f"{name}_count{etiqueta} {hist[2]}")
+        return lines
+
+    def _write_prom(self) -> None:
+        lines = [
+            "# HELP zking_jobs_total Trabajos terminados por resultado.",
+            "# TYPE zking_jobs_total counter",
+            *(f'zking_jobs_total{{outcome="{k}"}} {v}' for k, v in sorted(self.jobs_total.items())),
+            "# HELP zking_downloaded_bytes_total Bytes descargados.",
+            "# TYPE zking_downloaded_bytes_total counter",
+            f"zking_downloaded_bytes_total {self.bytes_total}",
+            "# HELP zking_phase_seconds Duración de cada fase de un trabajo.",
+            "# TYPE zking_phase_seconds histogram",
+        ]
+        for phase, hist in sorted(self.phase_hist.items()):
+            lines += self._hist_lines("zking_phase_seconds", hist, f'phase="{phase}"')
+        lines += [
+            "# HELP zking_job_seconds Duración total de cada trabajo.",
+            "# TYPE zking_job_seconds histogram",
+            *self._hist_lines("zking_job_seconds", self.job_hist),
+        ]
+        tmp_path = f"{self.prom_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prom_path)
+
+# ===================== estado por descarga ===================== #
+
+class DownloadJob:
+    """Estado propio de una descarga (una URL), independiente del resto del lote."""
+
+    PENDIENTE = "pendiente"
+    EN_CURSO = "en curso"
+    COMPLETADO = "completado"
+    SALTADO = "saltado"  # ya estaba en el archivo de descargas
+    ERROR = "error"
+
+    def __init__(self, index: int, url: str, only_mp3: bool = False,
+                 itag: str | None = None, format_desc: str = "") -> None:
+        self.index = index
+        self.url = url
+        self.only_mp3 = only_mp3
+        self.itag = itag
+        self.format_desc = format_desc
+        self.format_reason = ""  # por qué se eligió el formato (select_video_format)
+        self.title: str = ""
+        self.thumbnail_url: str | None = None
+        self.formats: list[tuple[str, str]] = []  # (descripcion, itag)
+        self.info: dict | None = None  # info de yt-dlp, se extrae una sola vez por trabajo
+        self.status = self.PENDIENTE
+        self.phase = ""
+        self.downloaded_bytes = 0
+        self.total_bytes = 0
+        self.speed = 0.0
+        self.streams: dict[str, tuple[int, int, float]] = {}  # flujo -> (bajados, total, velocidad)
+        self.lock = threading.Lock()
+        self.start_time: float | None = None
+        self.end_time: float | None = None
+        self.output_file: str | None = None
+        self.video_path: str = ""  # "remux" (copia H.264), "transcode" o "chunked" (por trozos)
+        self.temp_dir: str = ""
+        self.temp_files: list[str] = []
+        self.audio_file: str | None = None
+        self.video_file: str | None = None
+        self.video_codec: str | None = None
+        self.journal: JobJournal | None = None
+        self.key_lock: threading.Lock | None = None  # clave de JobJournal en uso (DownloadEngine.fetch)
+        self.archive_key: str | None = None
+        self.partial_output: str | None = None
+        self.resumed: list[str] = []  # fases que se saltaron gracias al diario
+        self.duration: float | None = None  # segundos, del info de yt-dlp
+        self.encode: dict = {}  # avance de FFmpeg: out_time, fps, speed, percent, eta
+        self.encode_stats: dict = {}  # al terminar: segundos, velocidad (x tiempo real), fps
+        self.timings: dict[str, float] = {}  # fase -> segundos (metadata, audio, video, mux...)
+        self.fetched_bytes = 0
+        self.error: Exception | None = None
+
+    @property
+    def safe_title(self) -> str:
+        return safe_filename(self.title or "video")
+
+    @property
+    def percent(self) -> float:
+        """Avance de la fase actual (0-100): descarga de flujos o codificación con FFmpeg."""
+        if self.status in (self.COMPLETADO, self.SALTADO):
+            return 100.0
+        if self.encode:
+            return self.encode["percent"]
+        if not self.total_bytes:
+            return 0.0
+        return min(100.0, self.downloaded_bytes / self.total_bytes * 100)
+
+    @property
+    def elapsed(self) -> float:
+        if not self.start_time:
+            return 0.0
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (self.COMPLETADO, self.SALTADO, self.ERROR)
+
+
+def aggregate_progress(jobs: list[DownloadJob]) -> dict:
+    """Resume el avance de un lote: porcentaje medio, velocidad total y contadores."""
+    total = len(jobs)
+    done = sum(1 for j in jobs if j.status == DownloadJob.COMPLETADO)
+    failed = sum(1 for j in jobs if j.status == DownloadJob.ERROR)
+    skipped = sum(1 for j in jobs if j.status == DownloadJob.SALTADO)
+    active = [j for j in jobs if j.status == DownloadJob.EN_CURSO]
+    percent = sum(100.0 if j.finished else j.percent for j in jobs) / total if total else 0.0
+    return {
+        "total": total,
+        "done": done,
+        "failed": failed,
+        "skipped": skipped,
+        "active": len(active),
+        "percent": percent,
+        "speed": sum(j.speed for j in active),
+    }
+
+# ===================== motor de descarga ===================== #
+
+class DownloadEngine:
+    """
+    Fases de descarga y conversión de un DownloadJob. Las encadena
+    DownloadPipeline, que además consulta el archivo de descargas, libera la
+    clave y la reserva de disco y registra las métricas de cada trabajo.
+    """
+
+    def __init__(self, download_folder: str, encoder: str | None = None, on_update=None,
+                 prefer_h264: bool = False, metadata_cache: MetadataCache | None = None,
+                 max_height: int | None = None, staging_dir: str | None = None,
+                 encoder_preset: str | None = None, chunked: bool | None = None,
+                 chunk_seconds: float = 30, chunk_workers: int | None = None,
+                 disk_budget: DiskBudget | None = None,
+                 archive: DownloadArchive | None = None,
+                 bandwidth: BandwidthManager | None = None,
+                 segment_connections: int = 4,
+                 segmented_min_bytes: int = 32 * 1024 * 1024,
+                 metrics: MetricsRecorder | None = None, ydl_factory=None,
+                 encoder_fps: float | None = None) -> None:
+        self.download_folder = download_folder
+        self.encoder = encoder or "libx264"
+        self.encoder_preset = encoder_preset
+        self.encoder_fps = encoder_fps  # medido con probe_encoders; lo usa la elección de formato
+        # Recodificación por trozos en paralelo: None = automática (solo CPU y videos largos)
+        self.chunked = chunked
+        self.chunk_seconds = chunk_seconds
+        self.chunk_workers = chunk_workers
+        self.on_update = on_update
+        self.prefer_h264 = prefer_h264
+        self.metadata_cache = metadata_cache
+        self.max_height = max_height
+        # Carpeta de intermedios (p. ej. un tmpfs); cada trabajo usa su propia subcarpeta
+        self.staging_dir = (staging_dir or os.environ.get("ZKING_STAGING_DIR")
+                            or os.path.join(download_folder, "temp"))
+        self.disk_budget = disk_budget or DiskBudget()
+        self.bandwidth = bandwidth or BandwidthManager()
+        self.ydl_factory = ydl_factory
+        self.metrics = metrics or MetricsRecorder(os.path.join(download_folder, METRICS_FOLDER))
+        # Flujos de video progresivos (http/https) grandes: varias conexiones por rangos
+        self.segment_connections = segment_connections
+        self.segmented_min_bytes = segmented_min_bytes
+        self.archive = archive or DownloadArchive(os.path.join(download_folder, DOWNLOAD_ARCHIVE_FILE))
+        self._claimed_outputs: set[str] = set()
+        self._claimed_lock = threading.Lock()
+        self._key_locks: dict[str, threading.Lock] = {}  # JobJournal.key_for -> trabajo en curso
+
+    def notify(self, job: DownloadJob) -> None:
+        if self.on_update:
+            self.on_update(job)
+
+    def _ydl(self, ydl_opts: dict):
+        """YoutubeDL para extraer o descargar; `ydl_factory` permite inyectar otro (p. ej. en benchmarks)."""
+        # Los mensajes de yt-dlp van al logger "zking" (avisos y errores a stderr):
+        # stdout queda solo para quien usa el motor (la CLI emite JSON por ahí).
+        ydl_opts = {"logger": log, **ydl_opts}
+        if self.ydl_factory is not None:
+            return self.ydl_factory(ydl_opts)
+        import yt_dlp  # import diferido: tarda en cargar y no hace falta al arrancar
+
+        return yt_dlp.YoutubeDL(ydl_opts)
+
+    @contextmanager
+    def _timed(self, job: DownloadJob, phase: str):
+        """Suma al trabajo el tiempo que tarda el bloque en la fase indicada."""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            with job.lock:
+                job.timings[phase] = job.timings.get(phase, 0.0) + time.perf_counter() - inicio
+
+    def record(self, job: DownloadJob) -> None:
+        """Anota el trabajo terminado (bien, mal o saltado) en el log y las métricas."""
+        self.metrics.record(job, self.encoder, self.profile_for(job))
+
+    def _set_phase(self, job: DownloadJob, phase: str) -> None:
+        job.phase = phase
+        job.streams = {}
+        job.downloaded_bytes = 0
+        job.total_bytes = 0
+        job.speed = 0.0
+        self.notify(job)
+
+    def resolve(self, job: DownloadJob) -> None:
+        """
+        Obtiene título, miniatura y formatos; si no hay itag elegido usa el de menor
+        coste en la mayor resolución permitida (ver rank_video_formats) y guarda el
+        motivo en job.format_reason. La info se guarda en el trabajo para que las descargas no
+        vuelvan a extraerla (si ya viene de list_formats no se pide de nuevo).
+        """
+        if job.info is None:
+            ydl_opts = {"quiet": True, "noprogress": True, "skip_download": True}
+            with self._timed(job, "metadata"), self._ydl(ydl_opts) as ydl:
+                job.info = ydl.extract_info(job.url, download=False)
+            if self.metadata_cache is not None:
+                self.metadata_cache.put(extraer_video_id(job.url), job.info)
+        info = job.info
+        job.title = info.get("title", "video")
+        job.thumbnail_url = info.get("thumbnail")
+        job.formats = video_only_formats(info, self.prefer_h264, self.encoder, self.encoder_fps)
+        if not job.itag and job.formats:
+            elegido, job.format_reason = select_video_format(
+                info, encoder=self.encoder, encoder_fps=self.encoder_fps, max_height=self.max_height,
+                prefer_h264=self.prefer_h264, bandwidth=self.bandwidth.rate_limit)
+            if elegido is not None:
+                job.itag = elegido["format_id"]
+                job.format_desc = next((d for d, itag in job.formats if itag == job.itag), "")
+        self.notify(job)
+
+    def progress_hook(self, job: DownloadJob, d: dict, stream: str = "audio") -> None:
+        """Suma el avance de cada flujo (audio/video) en un único contador del trabajo."""
+        if d["status"] == "downloading":
+            downloaded = d.get("downloaded_bytes", 0)
+            total = d.get("total_bytes") or d.get("total_bytes_estimate", 1)
+            speed = d.get("speed") or 0  # si es None, usa 0
+            with job.lock:
+                previo = job.streams.get(stream, (downloaded, 0, 0))[0]
+                job.streams[stream] = (downloaded, total, speed)
+                job.downloaded_bytes = sum(s[0] for s in job.streams.values())
+                job.total_bytes = sum(s[1] for s in job.streams.values())
+                job.speed = sum(s[2] for s in job.streams.values())
+            self.notify(job)
+            # Puede dormir: así se aplica el límite global de velocidad
+            self.bandwidth.consume(job.index, downloaded - previo)
+
+    def _fetch_streams(self, job: DownloadJob,
+                       opts_by_stream: dict[str, dict]) -> dict[str, tuple[str, dict]]:
+        """Descarga a la vez los flujos pedidos ({flujo: ydl_opts}) y devuelve (ruta, info)."""
+
+        def fetch(stream: str, ydl_opts: dict) -> tuple[str, dict]:
+            with self._timed(job, stream):
+                return download(stream, ydl_opts)
+
+        def download(stream: str, ydl_opts: dict) -> tuple[str, dict]:
+            fmt = self._segmentable_format(job) if stream == "video" else None
+            if fmt is not None:
+                path = ydl_opts["outtmpl"].replace("%(ext)s", fmt.get("ext") or "mp4")
+                try:
+                    self._fetch_segmented(job, fmt, path, stream)
+                except RangeNotSupported:
+                    fmt = None  # se descarga con yt-dlp como siempre
+                else:
+                    if job.journal is not None:
+                        job.journal.mark(stream, file=path, vcodec=fmt.get("vcodec"))
+                    return path, fmt
+
+            ydl_opts = dict(ydl_opts, **self.bandwidth.open_stream((job.index, stream)),
+                            progress_hooks=[lambda d: self.progress_hook(job, d, stream)])
+            try:
+                with self._ydl(ydl_opts) as ydl:
+                    # Reutiliza la info ya resuelta: solo se aplica la selección de formato
+                    # y se descarga, sin otra petición de extracción. Se quita la selección
+                    # anterior (requested_formats) o yt-dlp bajaría esa en lugar de la pedida.
+                    info = {k: v for k, v in ydl.sanitize_info(job.info).items()
+                            if k not in ("requested_formats", "requested_downloads")}
+                    info = ydl.process_ie_result(info, download=True)
+                    path = ydl.prepare_filename(info)
+            finally:
+                self.bandwidth.close_stream((job.index, stream))
+            if job.journal is not None:
+                job.journal.mark(stream, file=path, vcodec=info.get("vcodec"))
+            return path, info
+
+        with ThreadPoolExecutor(max_workers=len(opts_by_stream),
+                                thread_name_prefix="flujo") as pool:
+            futures = {stream: pool.submit(fetch, stream, opts)
+                       for stream, opts in opts_by_stream.items()}
+            # .result() relanza el error del flujo que haya fallado
+            return {stream: fut.result() for stream, fut in futures.items()}
+
+    def _segmentable_format(self, job: DownloadJob) -> dict | None:
+        """Formato de video a bajar por rangos: progresivo http(s) y más grande que el umbral."""
+        if self.segment_connections < 2 or not job.info:
+            return None
+        fmt = next((f for f in job.info.get("formats", []) if f.get("format_id") == job.itag), None)
+        if fmt is None or fmt.get("protocol") not in ("http", "https") or not fmt.get("url"):
+            return None
+        size = fmt.get("filesize") or fmt.get("filesize_approx") or 0
+        return fmt if size >= self.segmented_min_bytes else None
+
+    def _fetch_segmented(self, job: DownloadJob, fmt: dict, path: str, stream: str) -> None:
+        lock = threading.Lock()
+        inicio = time.time()
+        descargado = 0
+
+        def on_progress(nbytes: int) -> None:
+            nonlocal descargado
+            # Bajo el lock para que el hook reciba los totales en orden
+            with lock:
+                descargado += nbytes
+                transcurrido = time.time() - inicio
+                self.progress_hook(job, {
+                    "status": "downloading",
+                    "downloaded_bytes": descargado,
+                    "total_bytes": downloader.total_bytes,
+                    "speed": descargado / transcurrido if transcurrido else 0,
+                }, stream)
+
+        # Las conexiones por rango cuentan en el mismo presupuesto que los fragmentos
+        concedidas = self.bandwidth.open_stream((job.index, stream))["concurrent_fragment_downloads"]
+        downloader = SegmentedDownloader(
+            fmt["url"], path, fmt.get("filesize"), headers=fmt.get("http_headers"),
+            connections=min(self.segment_connections, concedidas),
+            retries=self.bandwidth.retries, on_progress=on_progress,
+        )
+        try:
+            downloader.download()
+        finally:
+            self.bandwidth.close_stream((job.index, stream))
+
+    @staticmethod
+    def _fases(job: DownloadJob) -> list[str]:
+        if job.only_mp3:
+            return ["1/3 Descargando audio...", "2/3 Convirtiendo a MP3...", "3/3 Borrando temporales..."]
+        return [
+            "1/3 Descargando audio y video...",
+            "2/3 Creando MP4 final...",
+            "3/3 Borrando temporales..."
+        ]
+
+    def fetch(self, job: DownloadJob) -> None:
+        """Etapa de red: descarga los flujos del trabajo a la carpeta temporal."""
+        if not job.itag and not job.only_mp3:
+            raise ValueError("Formato de video inválido seleccionado.")
+        if job.info is None:
+            self.resolve(job)
+
+        # Carpeta, diario y reserva de disco van por clave (video + perfil). Si el lote
+        # repite una URL, el segundo trabajo espera al primero y luego retoma lo que
+        # este dejó (normalmente el archivo final) en vez de pisar sus temporales.
+        clave = JobJournal.key_for(job)
+        with self._claimed_lock:
+            lock = self._key_locks.setdefault(clave, threading.Lock())
+        if not lock.acquire(blocking=False):
+            self._set_phase(job, "Esperando a otra descarga del mismo video...")
+            lock.acquire()
+        job.key_lock = lock
+
+        # Carpeta de trabajo propia y estable entre ejecuciones (la usa el diario)
+        job.temp_dir = os.path.join(self.staging_dir, clave)
+        outtmpl_audio = os.path.join(job.temp_dir, "audio.%(ext)s")
+        outtmpl_video = os.path.join(job.temp_dir, "video.%(ext)s")
+        ffmpeg_path = ffmpeg_executable()
+
+        ydl_opts_audio = {
+            "format": "bestaudio/best",
+            "outtmpl": outtmpl_audio,
+            "continuedl": True,  # retoma el .part si quedó a medias
+            "quiet": True,
+            "noprogress": True,
+            "ffmpeg_location": ffmpeg_path
+        }
+
+        ydl_opts_video = {
+            "format": job.itag,
+            "outtmpl": outtmpl_video,
+            "continuedl": True,
+            "quiet": True,
+            "noprogress": True,
+            "ffmpeg_location": ffmpeg_path
+        }
+
+        journal = job.journal = JobJournal(os.path.join(
+            self.download_folder, JOURNAL_FOLDER, clave + ".json"))
+        if journal.done(JobJournal.DONE, journal.get(JobJournal.DONE).get("output")):
+            # Ya terminado en una ejecución anterior
+            job.output_file = journal.get(JobJournal.DONE)["output"]
+            job.resumed.append(JobJournal.DONE)
+            return
+        os.makedirs(job.temp_dir, exist_ok=True)  # solo si de verdad hay algo que bajar
+
+        # Reserva espacio para los flujos (staging) y el archivo final (destino)
+        estimado = estimate_job_bytes(job.info, job.itag, job.only_mp3)
+        self.disk_budget.reserve(
+            clave,
+            {self.staging_dir: estimado, self.download_folder: estimado},
+            on_wait=lambda: self._set_phase(job, "Esperando espacio en disco..."),
+        )
+
+        # Fase 1: Descargar audio (y video en paralelo, si hace falta). Los flujos que el
+        # diario da por bajados no se piden; los .part a medias se continúan.
+        self._set_phase(job, self._fases(job)[0])
+        streams = {"audio": ydl_opts_audio}
+        if not job.only_mp3:
+            streams["video"] = ydl_opts_video
+        files = {}
+        for stream in list(streams):
+            entry = journal.get(stream)
+            if journal.done(stream, entry.get("file")):
+                files[stream] = (entry["file"], entry)
+                job.resumed.append(stream)
+                del streams[stream]
+        if streams:
+            nuevos = self._fetch_streams(job, streams)
+            job.fetched_bytes = sum(os.path.getsize(path) for path, _info in nuevos.values()
+                                    if os.path.exists(path))
+            files.update(nuevos)
+        job.audio_file = files["audio"][0]
+        job.temp_files.extend(path for path, _info in files.values())
+        if "video" in files:
+            job.video_file, info_video = files["video"]
+            job.video_codec = info_video.get("vcodec")
+        job.duration = job.info.get("duration") if job.info else None
+        job.info = None  # ya no hace falta; libera memoria en lotes grandes
+
+    def transcode(self, job: DownloadJob) -> None:
+        """Etapa de CPU: genera el MP3 o el MP4 final a partir de los flujos descargados."""
+        fases = self._fases(job)
+        ffmpeg_path = ffmpeg_executable()
+        journal = job.journal
+        if JobJournal.DONE in job.resumed:
+            return
+        if journal is not None:
+            entry = journal.get(JobJournal.TRANSCODE)
+            if journal.done(JobJournal.TRANSCODE, entry.get("output")):
+                job.output_file = entry["output"]
+                job.video_path = entry.get("video_path", "")
+                job.encode_stats = entry.get("encode", {})
+                job.resumed.append(JobJournal.TRANSCODE)
+                return
+
+        # El archivo se escribe con nombre temporal en la carpeta de destino y se
+        # renombra al terminar: rename atómico, sin copiar desde el staging.
+        job.output_file = self._claim_output(job, "mp3" if job.only_mp3 else "mp4")
+        ext = os.path.splitext(job.output_file)[1]
+        job.partial_output = os.path.join(
+            self.download_folder, f".{JobJournal.key_for(job)}.part{ext}")
+
+        # Duración para porcentaje y ETA: la del info de yt-dlp o, si falta, la del archivo
+        duration = job.duration or media_duration(ffmpeg_path, job.audio_file)
+        job.speed = 0.0
+        inicio = time.time()
+
+        def on_progress(info: dict) -> None:
+            job.encode = info
+            self.notify(job)
+
+        # Fase 2: Solo MP3 o Video+Audio
+        if job.only_mp3:
+            self._set_phase(job, fases[1])
+            with self._timed(job, "audio_convert"):
+                run_ffmpeg([
+                    ffmpeg_path, "-y", "-i", job.audio_file, "-vn", "-ab", "320k", "-ar", "44100",
+                    "-f", "mp3", job.partial_output
+                ], duration, on_progress)
+        else:
+            # Fase 2: Video + audio al MP4 final en una sola pasada. Si el video ya es
+            # H.264 basta con copiar el flujo; solo se recodifica si no es compatible.
+            if is_h264(job.video_codec):
+                job.video_path = "remux"
+                self._set_phase(job, f"{fases[1]} (copia H.264, sin recodificar)")
+                video_args = ["-c:v", "copy"]
+            else:
+                job.video_path = "transcode"
+                self._set_phase(job, f"{fases[1]} (recodificando con {self.encoder})")
+                video_args = video_encode_args(self.encoder, self.encoder_preset)
+            with self._timed(job, "mux" if job.video_path == "remux" else "transcode"):
+                if job.video_path == "transcode" and self._use_chunked(job, ffmpeg_path):
+                    job.video_path = "chunked"
+                    self._set_phase(job, f"{fases[1]} (recodificando por trozos con {self.encoder})")
+                    chunked_encode(ffmpeg_path, job.video_file, job.audio_file, job.partial_output,
+                                   video_args, os.path.join(job.temp_dir, "trozos"),
+                                   self.chunk_seconds, self.chunk_workers, duration, on_progress)
+                else:
+                    run_ffmpeg(
+                        mux_command(ffmpeg_path, job.video_file, job.audio_file, job.partial_output,
+                                    video_args),
+                        duration, on_progress,
+                    )
+        os.replace(job.partial_output, job.output_file)
+        job.partial_output = None
+
+        # Rendimiento de la codificación: segundos de media por segundo real, y fps medios
+        transcurrido = time.time() - inicio
+        job.encode_stats = {
+            "seconds": round(transcurrido, 2),
+            "media_seconds": duration,
+            "speed": round(duration / transcurrido, 2) if duration and transcurrido else None,
+            "fps": job.encode.get("fps"),
+        }
+        if journal is not None:
+            journal.mark(JobJournal.TRANSCODE, output=job.output_file, video_path=job.video_path,
+                         encode=job.encode_stats)
+
+    def _use_chunked(self, job: DownloadJob, ffmpeg_path: str) -> bool:
+        """Por trozos si se pidió, o en modo automático con libx264, 4+ núcleos y video largo."""
+        if self.chunked is not None:
+            return self.chunked
+        if self.encoder != "libx264" or (os.cpu_count() or 1) < 4:
+            return False
+        duration = media_duration(ffmpeg_path, job.video_file)
+        return bool(duration and duration >= 4 * self.chunk_seconds)
+
+    def finalize(self, job: DownloadJob) -> None:
+        """
+        Etapa final: borra la carpeta de trabajo y deja constancia en el diario y
+        en el archivo de descargas. Un trabajo que el diario ya daba por terminado
+        no toca nada (se informa como saltado).
+        """
+        if JobJournal.DONE not in job.resumed:
+            self._set_phase(job, self._fases(job)[-1])
+            with self._timed(job, "cleanup"):
+                # La carpeta de trabajo es solo de este trabajo: se borra entera
+                shutil.rmtree(job.temp_dir, ignore_errors=True)
+                job.temp_files = []
+            if job.journal is not None:
+                # El diario se conserva (es pequeño) para saltar el trabajo si se repite el lote
+                job.journal.mark(JobJournal.DONE, output=job.output_file)
+            if job.archive_key and job.output_file:
+                self.archive.add(job.archive_key, job.output_file)
+        try:
+            os.rmdir(self.staging_dir)  # solo si ya no quedan carpetas de otros trabajos
+        except OSError:
+            pass
+
+    def profile_for(self, job: DownloadJob) -> str:
+        """Perfil de salida: MP3, o formato de video (itag o política) + encoder."""
+        if job.only_mp3:
+            return "mp3"
+        if job.itag:
+            formato = job.itag
+        elif self.prefer_h264:
+            formato = "auto-h264"
+        else:
+            formato = f"auto-{self.max_height}p" if self.max_height else "auto-max"
+        return f"{formato}-{self.encoder}"
+
+    def archived(self, job: DownloadJob) -> bool:
+        """
+        Consulta el archivo de descargas sin tocar la red. Si el video ya se bajó
+        con este perfil y el archivo sigue en disco, deja el trabajo apuntando a él.
+        """
+        video_id = extraer_video_id(job.url)
+        if not video_id:
+            return False
+        job.archive_key = f"{video_id}_{self.profile_for(job)}"
+        output = self.archive.lookup(job.archive_key)
+        if output is None:
+            return False
+        job.output_file = output
+        job.title = job.title or os.path.splitext(os.path.basename(output))[0]
+        return True
+
+    def _claim_output(self, job: DownloadJob, ext: str) -> str:
+        """
+        Ruta final del archivo. Si el nombre ya está en uso (en disco o en el lote)
+        se prueba con el ID del video, luego con el perfil y por último con un
+        contador, hasta dar con uno libre.
+        """
+        video_id = extraer_video_id(job.url) or str(job.index)
+        base = f"{job.safe_title} [{video_id}]"
+        nombres = itertools.chain(
+            [job.safe_title, base, f"{base} [{self.profile_for(job)}]"],
+            (f"{base} ({n})" for n in itertools.count(2)))
+        with self._claimed_lock:
+            for nombre in nombres:
+                path = os.path.join(self.download_folder, f"{nombre}.{ext}")
+                if path not in self._claimed_outputs and not os.path.exists(path):
+                    break
+            self._claimed_outputs.add(path)
+        return path
+
+    def release(self, job: DownloadJob) -> None:
+        """Libera la reserva de disco y la clave al terminar el trabajo, bien o mal."""
+        lock, job.key_lock = job.key_lock, None
+        if lock is not None:
+            # Solo quien tiene la clave tiene reserva (otro trabajo igual puede seguir con la suya)
+            self.disk_budget.release(JobJournal.key_for(job))
+        if job.partial_output:
+            # FFmpeg falló: se borra la salida a medias y el nombre queda libre. Los
+            # nombres ya escritos siguen reservados para que otro título igual no los pise.
+            try:
+                os.remove(job.partial_output)
+            except OSError:
+                pass
+            with self._claimed_lock:
+                self._claimed_outputs.discard(job.output_file)
+            job.partial_output = None
+        if lock is not None:
+            lock.release()
+
+# ===================== pipeline por etapas ===================== #
+
+class PipelineStage:
+    """Una etapa del pipeline: cola de entrada acotada, workers propios y métricas."""
+
+    def __init__(self, name: str, func, workers: int, queue_size: int) -> None:
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue: queue.Queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.busy = 0
+        self.processed = 0
+        self.max_queued = 0
+        self.busy_seconds = 0.0
+        self._alive = self.workers
+        self._lock = threading.Lock()
+
+    def begin(self) -> None:
+        queued = self.queue.qsize()
+        with self._lock:
+            self.max_queued = max(self.max_queued, queued + 1)
+            self.busy += 1
+
+    def end(self, seconds: float) -> None:
+        with self._lock:
+            self.busy -= 1
+            self.processed += 1
+            self.busy_seconds += seconds
+
+    def worker_exited(self) -> bool:
+        """Registra la salida de un worker; True si era el último de la etapa."""
+        with self._lock:
+            self._alive -= 1
+            return self._alive == 0
+
+    def metrics(self) -> dict:
+        queued = self.queue.qsize()
+        with self._lock:
+            self.max_queued = max(self.max_queued, queued)
+            return {
+                "workers": self.workers,
+                "queued": queued,
+                "max_queued": self.max_queued,
+                "busy": self.busy,
+                "processed": self.processed,
+                "busy_seconds": round(self.busy_seconds, 2),
+            }
+
+
+class DownloadPipeline:
+    """
+    Procesa un lote como productor/consumidor por etapas: metadatos -> descarga ->
+    conversión -> limpieza. Cada etapa tiene sus propios workers y una cola de
+    entrada acotada, de modo que el video N+1 se descarga mientras el N se codifica
+    y una etapa lenta frena a la anterior en vez de acumular archivos.
+    """
+
+    STAGES = ("metadata", "fetch", "transcode", "finalize")
+    DEFAULT_WORKERS = {"metadata": 2, "fetch": MAX_WORKERS_DEFAULT, "transcode": 1, "finalize": 1}
+
+    def __init__(self, engine: DownloadEngine, workers: dict[str, int] | None = None,
+                 queue_size: int = 2, on_job_done=None) -> None:
+        self.engine = engine
+        self.on_job_done = on_job_done
+        workers = {**self.DEFAULT_WORKERS, **(workers or {})}
+        funcs = {
+            "metadata": self._resolve,
+            "fetch": engine.fetch,
+            "transcode": engine.transcode,
+            "finalize": engine.finalize,
+        }
+        self.stages = [PipelineStage(name, funcs[name], workers[name], queue_size)
+                       for name in self.STAGES]
+        self.jobs: list[DownloadJob] = []
+        self.started: float | None = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def music_workers(encoders: int | None = None, downloads: int | None = None) -> dict[str, int]:
+        """
+        Workers del modo música (lotes de solo MP3): un encoder por núcleo, ya que
+        cada conversión es un proceso FFmpeg que usa un solo núcleo, y al menos
+        tantas descargas como encoders para que no se queden sin pistas.
+        """
+        encoders = encoders or os.cpu_count() or 1
+        return {"metadata": 4, "fetch": downloads or max(MAX_WORKERS_DEFAULT, encoders),
+                "transcode": encoders, "finalize": 1}
+
+    @classmethod
+    def for_music(cls, engine: DownloadEngine, encoders: int | None = None,
+                  downloads: int | None = None, on_job_done=None) -> "DownloadPipeline":
+        """
+        Pipeline para lotes de solo MP3: las descargas siguen mientras un pool de
+        procesos FFmpeg (ver music_workers) convierte. La cola de conversión admite
+        una pista en espera por encoder; si los encoders se atrasan, las descargas
+        se detienen ahí en vez de llenar el disco de audios sin convertir.
+        """
+        workers = cls.music_workers(encoders, downloads)
+        return cls(engine, workers, queue_size=workers["transcode"], on_job_done=on_job_done)
+
+    def _resolve(self, job: DownloadJob) -> None:
+        job.status = DownloadJob.EN_CURSO
+        job.start_time = time.time()
+        if not job.title:
+            job.phase = "Obteniendo formatos..."
+            self.engine.resolve(job)
+
+    def progress(self) -> dict:
+        with self._lock:
+            resumen = aggregate_progress(self.jobs)
+        resumen["stages"] = self.stage_metrics()
+        resumen["throughput"] = self.engine.bandwidth.throughput()
+        # Trabajos (pistas, en modo música) terminados por minuto desde el inicio del lote
+        transcurrido = time.time() - self.started if self.started else 0.0
+        resumen["per_minute"] = round(resumen["done"] * 60 / transcurrido, 1) if transcurrido else 0.0
+        return resumen
+
+    def stage_metrics(self) -> dict[str, dict]:
+        """Profundidad de cola, workers ocupados y trabajos procesados por etapa."""
+        return {stage.name: stage.metrics() for stage in self.stages}
+
+    def _finish(self, job: DownloadJob, error: Exception | None = None) -> None:
+        if error is not None:
+            job.error = error
+            job.status = DownloadJob.ERROR
+        elif JobJournal.DONE in job.resumed:
+            # El diario ya lo daba por terminado (otra ejecución o la misma URL antes en el lote)
+            job.status = DownloadJob.SALTADO
+            job.phase = "Ya descargado"
+        else:
+            job.status = DownloadJob.COMPLETADO
+        job.end_time = time.time()
+        job.speed = 0.0
+        self._report(job, self.engine.release, self.engine.record, self.engine.notify,
+                     self.on_job_done)
+
+    def _skip(self, job: DownloadJob) -> None:
+        job.status = DownloadJob.SALTADO
+        job.phase = "Ya descargado"
+        self._report(job, self.engine.record, self.engine.notify, self.on_job_done)
+
+    @staticmethod
+    def _report(job: DownloadJob, *callbacks) -> None:
+        """
+        Limpieza, métricas y avisos de un trabajo terminado. Un fallo en uno (SQLite
+        bloqueado, disco lleno al escribir métricas...) se registra y no impide los
+        demás ni mata al worker, que dejaría el lote bloqueado.
+        """
+        for callback in callbacks:
+            if callback is None:
+                continue
+            try:
+                callback(job)
+            except Exception:
+                log.exception("Fallo al cerrar el trabajo %s (%s)", job.index, job.url)
+
+    def _worker(self, pos: int) -> None:
+        stage = self.stages[pos]
+        siguiente = self.stages[pos + 1] if pos + 1 < len(self.stages) else None
+        try:
+            while True:
+                job = stage.queue.get()
+                if job is None:
+                    break
+                stage.begin()
+                inicio = time.time()
+                try:
+                    stage.func(job)
+                except Exception as err:
+                    stage.end(time.time() - inicio)
+                    self._finish(job, err)
+                    continue
+                stage.end(time.time() - inicio)
+                if siguiente is not None:
+                    siguiente.queue.put(job)  # bloquea si la etapa siguiente va atrasada
+                else:
+                    self._finish(job)
+        finally:
+            # El último worker en salir avisa a la etapa siguiente (aunque este haya fallado)
+            if stage.worker_exited() and siguiente is not None:
+                for _ in range(siguiente.workers):
+                    siguiente.queue.put(None)
+
+    def run(self, jobs: list[DownloadJob]) -> list[DownloadJob]:
+        """Procesa el lote y bloquea hasta que terminan todos los trabajos."""
+        with self._lock:
+            self.jobs = list(jobs)
+        self.started = time.time()
+        threads = []
+        for pos, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                t = threading.Thread(target=self._worker, args=(pos,),
+                                     name=f"{stage.name}-{n}", daemon=True)
+                t.start()
+                threads.append(t)
+
+        entrada = self.stages[0]
+        try:
+            for job in jobs:
+                if self.engine.archived(job):
+                    self._skip(job)  # antes de cualquier petición de red
+                    continue
+                entrada.queue.put(job)  # bloquea mientras la cola de metadatos esté llena
+        finally:
+            for _ in range(entrada.workers):
+                entrada.queue.put(None)
+
+        for t in threads:
+            t.join()
+        return jobs